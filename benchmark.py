@@ -0,0 +1,952 @@
+import asyncio
+import filecmp
+import json
+import networkx
+import numpy
+import os
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import pickle
+import random
+import tracemalloc
+import warnings
+import convert_sim_data
+from collections import defaultdict, OrderedDict
+from itertools import count, chain
+from dataclasses import dataclass, field
+from time import perf_counter
+from typing import NamedTuple, Optional, Dict, Tuple
+from sim_engine import SimEngine, SimState, StateStore, Colour, Player, UNSOLVED, NONE, default_cache_path
+from sim_solution import read_solution, HEADER
+from noughts_and_crosses import NoughtsAndCrosses
+from sim import Sim
+from pipeline import MemoryFrontier
+from codes import StateRanking
+from matcher import ReplyMatcher
+from ramsey_engine import RamseyEngine
+from server import ReplyService
+from expander import Expander
+from metrics import Metrics, SummarySink, null_metrics
+
+class VertexCounts(NamedTuple):
+    red: int
+    blue: int
+    red_triangles: int
+    blue_triangles: int
+
+class StateInvariants(NamedTuple):
+    player: Player
+    vertex_classes: Tuple[int, ...]
+
+class SimInvariants:
+    def __init__(self, engine):
+        self.engine = engine
+        self.incident_masks = {
+            v: sum(1 << eid for (edge, eid) in engine.edge_ids.items() if v in edge)
+            for v in engine.vertices}
+        self.neighbour_edges = tuple(
+            tuple((u, engine.edge_ids[engine.sort_edge((v, u))]) for u in engine.vertices if u != v)
+            for v in engine.vertices)
+        self.third_vertices = {
+            eid: tuple(v for v in engine.vertices if v not in edge)
+            for (edge, eid) in engine.edge_ids.items()}
+        self.vertex_triangles = {
+            v: tuple(triangle for triangle in sorted(engine.triangle_set) if triangle & mask)
+            for (v, mask) in self.incident_masks.items()}
+    def degree_sequence(self, state):
+        red, blue = state.red, state.blue
+        return tuple(sorted(
+            ((red & mask).bit_count(), (blue & mask).bit_count())
+            for mask in self.incident_masks.values()))
+    def degree_invariants(self, state):
+        return state.player, self.degree_sequence(state)
+    def vertex_counts(self, state):
+        red, blue = state.red, state.blue
+        return tuple(
+            VertexCounts(
+                (red & mask).bit_count(), (blue & mask).bit_count(),
+                sum(red & triangle == triangle for triangle in self.vertex_triangles[v]),
+                sum(blue & triangle == triangle for triangle in self.vertex_triangles[v]))
+            for (v, mask) in self.incident_masks.items())
+    def play(self, state, counts, option):
+        blue = int(state.player.value)
+        mine = state.blue if blue else state.red
+        counts = [list(c) for c in counts]
+        (u, v) = self.engine.edges[option]
+        completed = 0
+        for (w, triangle) in zip(self.third_vertices[option], self.engine.triangle_masks[option]):
+            if mine & triangle == triangle:
+                counts[w][2 + blue] += 1
+                completed += 1
+        for w in (u, v):
+            counts[w][blue] += 1
+            counts[w][2 + blue] += completed
+        return state.apply(option), tuple(VertexCounts(*c) for c in counts)
+    def successor_invariants(self, state):
+        counts = self.vertex_counts(state)
+        for option in state.options():
+            next_state, next_counts = self.play(state, counts, option)
+            yield option, next_state, self(next_state, next_counts)
+    def __call__(self, state, counts=None):
+        counts = self.vertex_counts(state) if counts is None else counts
+        red, blue = state.red, state.blue
+        classes = [hash(c) for c in counts]
+        distinct = len(set(classes))
+        while True:
+            classes = [
+                hash((classes[v], tuple(sorted((red >> e & 1 | (blue >> e & 1) << 1, classes[u]) for (u, e) in neighbours))))
+                for (v, neighbours) in enumerate(self.neighbour_edges)]
+            if len(set(classes)) == distinct:
+                break
+            distinct = len(set(classes))
+        return StateInvariants(state.player, tuple(sorted(classes)))
+
+def expand_state(engine, state):
+    return [
+        (option, engine.canonicalise(state.apply(option)), engine.evaluate_state(state.apply(option), option))
+        for option in state.options()]
+
+class IsomorphismCanonicaliser:
+    def __init__(self, engine, metrics=null_metrics, invariants=None):
+        self.engine = engine
+        self.metrics = metrics
+        self.invariants = invariants or SimInvariants(engine)
+        self.canonical_states = {}
+        self.states_by_invariants = defaultdict(list)
+    def is_isomorphic(self, colours, other_colours):
+        g1 = networkx.generators.complete_graph(6)
+        g2 = networkx.generators.complete_graph(6)
+        c1 = {edge: colour for (edge, colour) in zip(self.engine.edges,colours)}
+        c2 = {edge: colour for (edge, colour) in zip(self.engine.edges,other_colours)}
+        networkx.set_edge_attributes(g1, c1, 'colour')
+        networkx.set_edge_attributes(g2, c2, 'colour')
+        em = networkx.algorithms.isomorphism.categorical_edge_match('colour', Colour.empty)
+        return networkx.is_isomorphic(g1, g2, edge_match=em)
+    def canonicalise(self, state, invariants=None):
+        try:
+            canon_state = self.canonical_states[state]
+            self.metrics.count('canonical.hits')
+            return canon_state
+        except KeyError:
+            self.metrics.count('canonical.misses')
+        invariants = self.invariants(state) if invariants is None else invariants
+        self.metrics.observe('canonical.bucket', len(self.states_by_invariants[invariants]))
+        for canon_state in self.states_by_invariants[invariants]:
+            if state.player != canon_state.player:
+                continue
+            self.metrics.count('canonical.is_isomorphic')
+            if self.is_isomorphic(state.colours, canon_state.colours):
+                self.canonical_states[state] = canon_state
+                return canon_state
+        self.canonical_states[state] = state
+        self.states_by_invariants[invariants].append(state)
+        return state
+
+@dataclass
+class LegacyStateDetails:
+    expanded: bool = False
+    in_progress: Optional[bool] = None
+    winner: Optional[Player] = None
+    value: Optional[int] = None
+    optimal_play: Optional[int] = None
+    successors: Dict[int, SimState] = field(default_factory=dict)
+
+def legacy_state_details(engine):
+    return {
+        state: LegacyStateDetails(
+            True, details.in_progress, details.winner, details.value, details.optimal_play,
+            dict(details.successors.items()))
+        for (state, details) in engine.state_details.items()}
+
+class BaselineSimState(NamedTuple):
+    player: Player
+    colours: Tuple[Colour, ...]
+
+class BaselineStateInvariants(NamedTuple):
+    player: Player
+    degree_sequence: Tuple[Tuple[int, int], ...]
+
+def baseline_state(state):
+    return BaselineSimState(state.player, state.colours)
+
+def write_baseline_pickle(path):
+    main = sys.modules['__main__']
+    for (name, cls) in (('SimState', BaselineSimState), ('StateInvariants', BaselineStateInvariants), ('StateDetails', LegacyStateDetails)):
+        cls.__module__, cls.__qualname__ = '__main__', name
+        setattr(main, name, cls)
+    engine = SimEngine()
+    engine.map_state_space()
+    engine.perform_minimax()
+    invariants = SimInvariants(engine)
+    canonical_states = {}
+    states_by_invariants = defaultdict(list)
+    state_details = {}
+    for (state, details) in legacy_state_details(engine).items():
+        canonical_states[baseline_state(state)] = baseline_state(state)
+        states_by_invariants[BaselineStateInvariants(state.player, invariants.degree_sequence(state))].append(baseline_state(state))
+        details.successors = {option: baseline_state(next_state) for (option, next_state) in details.successors.items()}
+        state_details[baseline_state(state)] = details
+    with open(path, 'wb') as f:
+        pickle.dump((canonical_states, states_by_invariants, state_details), f)
+
+def generated_states(engine):
+    engine.map_state_space()
+    return [
+        state.apply(option)
+        for (state, details) in engine.state_details.items()
+        if details.in_progress
+        for option in details.successors]
+
+def time_canonicalise(canonicalise, states):
+    start = perf_counter()
+    canon_states = [canonicalise(state) for state in states]
+    return perf_counter() - start, canon_states
+
+def compare_canonicalisers():
+    engine = SimEngine()
+    states = [SimState.initial_state()] + generated_states(engine)
+    legacy_time, legacy_canon = time_canonicalise(IsomorphismCanonicaliser(engine).canonicalise, states)
+    permutation_time, permutation_canon = time_canonicalise(engine.canonicalise, states)
+    classes = {}
+    for (legacy, canon) in zip(legacy_canon, permutation_canon):
+        assert classes.setdefault(legacy, canon) == canon, 'canonicalisers disagree'
+    assert len(classes) == len(set(permutation_canon)), 'canonicalisers disagree'
+    print(f'{len(states)} states, {len(classes)} classes')
+    print(f'isomorphism: {legacy_time:.3f}s ({1e6*legacy_time/len(states):.1f}us/state)')
+    print(f'permutation: {permutation_time:.3f}s ({1e6*permutation_time/len(states):.1f}us/state)')
+
+def compare_invariants():
+    engine = SimEngine()
+    engine.map_state_space()
+    invariants = SimInvariants(engine)
+    parents = [state for (state, details) in engine.state_details.items() if details.in_progress]
+    start = perf_counter()
+    for state in parents:
+        for option in state.options():
+            invariants(state.apply(option))
+    scratch_time = perf_counter() - start
+    start = perf_counter()
+    successors = [successor for state in parents for successor in invariants.successor_invariants(state)]
+    incremental_time = perf_counter() - start
+    print(f'{len(successors)} successors: invariants from scratch {scratch_time:.3f}s, incremental {incremental_time:.3f}s')
+    for (name, bucket_key, incremental) in (('degree sequence', invariants.degree_invariants, False), ('refined', invariants, True)):
+        print(name)
+        with Metrics(SummarySink(sys.stdout)) as metrics:
+            canonicaliser = IsomorphismCanonicaliser(engine, metrics, bucket_key)
+            start = perf_counter()
+            for (option, state, state_invariants) in successors:
+                canonicaliser.canonicalise(state, state_invariants if incremental else None)
+            metrics.time('canonical.total', perf_counter() - start)
+
+def loaded_size(data):
+    tracemalloc.start()
+    loaded = pickle.loads(data)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size, loaded
+
+def time_lookups(state_details, queries, repeats=5):
+    times = []
+    for _ in range(repeats):
+        start = perf_counter()
+        for (state, option) in queries:
+            state_details[state].successors[option]
+        times.append(perf_counter() - start)
+    return min(times)
+
+def compare_stores(lookups=100000, seed=0):
+    engine = SimEngine()
+    engine.map_state_space()
+    engine.perform_minimax()
+    rng = random.Random(seed)
+    moves = [(state, option) for (state, details) in engine.state_details.items() for option in details.successors]
+    queries = [rng.choice(moves) for _ in range(lookups)]
+    for (name, state_details) in (('dataclasses', legacy_state_details(engine)), ('arrays', engine.state_details)):
+        data = pickle.dumps(state_details)
+        size, loaded = loaded_size(data)
+        lookup_time = time_lookups(loaded, queries)
+        print(f'{name}: {size/len(loaded):.0f} bytes/state in memory, {len(data)/len(loaded):.0f} bytes/state pickled, {1e9*lookup_time/lookups:.0f}ns/lookup')
+
+def reset_solution(engine):
+    store = engine.state_details
+    store.value[:store.size][store.in_progress[:store.size]] = UNSOLVED
+    store.optimal_play[:store.size] = NONE
+
+def compare_solvers():
+    engine = SimEngine(cache_path=None)
+    engine.map_state_space()
+    root = engine.state_details.ids[SimState.initial_state()]
+    reset_solution(engine)
+    start = perf_counter()
+    engine.minimax(root)
+    minimax_time = perf_counter() - start
+    reset_solution(engine)
+    start = perf_counter()
+    engine.retrograde()
+    retrograde_time = perf_counter() - start
+    engine.cross_check()
+    print(f'minimax: {1e3*minimax_time:.1f}ms, retrograde: {1e3*retrograde_time:.1f}ms')
+
+def compare_queries(queries=20, seed=0, transposition_size=1 << 16):
+    solved = SimEngine()
+    rng = random.Random(seed)
+    positions = rng.sample([state for (state, details) in solved.state_details.items() if details.in_progress], queries)
+    presolved = SimEngine(cache_path=None)
+    tracemalloc.start()
+    start = perf_counter()
+    presolved.map_state_space()
+    presolved.retrograde()
+    presolve_time = perf_counter() - start
+    presolve_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f'full pre-solve: {presolve_time:.3f}s, heap peak {presolve_peak/2**20:.2f} MiB')
+    engine = SimEngine(cache_path=None, transposition_size=transposition_size)
+    tracemalloc.start()
+    times = []
+    for state in positions:
+        start = perf_counter()
+        assert engine.evaluate(state) == solved.state_details[state].value, 'query disagrees with the solution'
+        times.append(perf_counter() - start)
+    query_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    warm = []
+    for state in positions:
+        start = perf_counter()
+        engine.best_move(state)
+        warm.append(perf_counter() - start)
+    print(f'first query: {1e3*times[0]:.1f}ms, mean cold query: {1e3*sum(times)/len(times):.1f}ms, '
+        f'mean cached query: {1e6*sum(warm)/len(warm):.0f}us, '
+        f'{len(engine.transpositions)} transpositions, heap peak {query_peak/2**20:.2f} MiB')
+
+def check_ramsey():
+    solved = SimEngine()
+    engine = RamseyEngine(6)
+    for (state, details) in solved.state_details.items():
+        masks = (state.red, state.blue)
+        assert engine.evaluate(masks) == details.value, f'{state} value differs'
+        if details.in_progress:
+            played = state.apply(engine.best_move(masks))
+            value = played.player.win_value() if solved.is_terminal(played) else solved.state_details[solved.canonicalise(played)].value
+            assert value - (1 if value > 0 else -1) == details.value, f'{state} best move differs'
+
+def compare_ramsey(sizes=(4, 5, 6)):
+    check_ramsey()
+    for vertices in sizes:
+        with open(os.devnull, 'w') as devnull, Metrics(SummarySink(devnull)) as metrics:
+            engine = RamseyEngine(vertices, metrics=metrics)
+            start = perf_counter()
+            value = engine.evaluate()
+            seconds = perf_counter() - start
+            nodes = metrics.sinks[0].counts['ramsey.nodes']
+        print(f'K{vertices}: value {value}, {nodes} nodes, {seconds:.2f}s')
+
+def states_per_second(count, seconds):
+    return f'{count / seconds:,.0f} states/s'
+
+def compare_batches(batch_sizes=(1, 16, 256)):
+    engine = SimEngine(cache_path=None)
+    engine.map_state_space()
+    store = engine.state_details
+    frontier = numpy.flatnonzero(store.in_progress[:store.size])
+    states = [store.state(i) for i in frontier.tolist()]
+    start = perf_counter()
+    expansions = [expand_state(engine, state) for state in states]
+    scalar_time = perf_counter() - start
+    start = perf_counter()
+    parents, options, children, in_progress = engine.expand_batch(store.states[frontier])
+    batch_time = perf_counter() - start
+    assert sorted(zip(parents.tolist(), options.tolist(), children.tolist(), in_progress.tolist())) == sorted(
+        (parent, option, next_state, next_in_progress)
+        for (parent, expansion) in enumerate(expansions)
+        for (option, next_state, next_in_progress) in expansion), 'batch expansion differs'
+    print(f'sim expand: {len(states)} states, per state {states_per_second(len(states), scalar_time)}, batched {states_per_second(len(states), batch_time)}')
+    start = perf_counter()
+    SimEngine(cache_path=None).map_state_space()
+    print(f'sim map_state_space: {states_per_second(len(store), perf_counter() - start)}')
+    game = NoughtsAndCrosses()
+    states = reachable_states(game)
+    start = perf_counter()
+    for state in states:
+        game.engine.outcome(*game.boardify(state)[1:], state[0])
+    scalar_time = perf_counter() - start
+    start = perf_counter()
+    game.prepare(states)
+    batch_time = perf_counter() - start
+    print(f'xo outcomes: {len(states)} states, per state {states_per_second(len(states), scalar_time)}, batched {states_per_second(len(states), batch_time)}')
+    for batch_size in batch_sizes:
+        start_states = [(game.canonicalise(state), message) for (state, message) in game.start_states()]
+        start = perf_counter()
+        explored = sum(1 for _ in game.explore(start_states, game.canonicalise, MemoryFrontier(), batch_size=batch_size))
+        print(f'xo explore, batches of {batch_size}: {states_per_second(explored, perf_counter() - start)}')
+
+def compare_explorers(processes=(1, 2, 4)):
+    graphs = {}
+    for workers in processes:
+        engine = SimEngine(workers)
+        engine.complete = False
+        engine.state_details = StateStore()
+        start = perf_counter()
+        engine.map_state_space()
+        print(f'{workers} processes: {perf_counter() - start:.3f}s')
+        store = engine.state_details
+        graphs[workers] = (store.states[:store.size], store.successors[:store.size])
+    reference = graphs[processes[0]]
+    for graph in graphs.values():
+        assert all(numpy.array_equal(a, b) for (a, b) in zip(graph, reference)), 'state graphs differ'
+
+def load_pickle(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+def compare_loading(repeats=20):
+    engine = SimEngine()
+    engine.map_state_space()
+    engine.perform_minimax()
+    state = SimState.initial_state()
+    with tempfile.TemporaryDirectory() as directory:
+        pickle_path = os.path.join(directory, 'sim_data.pck')
+        with open(pickle_path, 'wb') as f:
+            pickle.dump(engine.state_details, f)
+        loaders = {
+            'pickle': lambda: load_pickle(pickle_path),
+            'mmap': lambda: StateStore.from_arrays(read_solution(engine.cache_path, engine.parameters_digest())),
+        }
+        for (name, loader) in loaders.items():
+            times = []
+            for _ in range(repeats):
+                start = perf_counter()
+                loader()[state].optimal_play
+                times.append(perf_counter() - start)
+            print(f'{name}: {1e3*min(times):.2f}ms to load and answer one lookup')
+
+def check_corruption():
+    engine = SimEngine()
+    engine.map_state_space()
+    engine.perform_minimax()
+    with open(engine.cache_path, 'rb') as f:
+        data = f.read()
+    fields = {'column name': HEADER.size, 'column dtype': HEADER.size + 16, 'column offset': HEADER.size + 32, 'payload': len(data) - 1}
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'sim_data.sim')
+        for (field, position) in fields.items():
+            with open(path, 'wb') as f:
+                f.write(data[:position] + b'\xff' + data[position + 1:])
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter('always')
+                corrupted = SimEngine(cache_path=path)
+            assert not corrupted.complete and caught, f'corrupt {field} was not detected'
+            print(f'corrupt {field}: {caught[0].message}')
+
+def check_conversion():
+    engine = SimEngine()
+    engine.map_state_space()
+    engine.perform_minimax()
+    with tempfile.TemporaryDirectory() as directory:
+        pickle_path = os.path.join(directory, 'sim_data.pck')
+        solution_path = os.path.join(directory, 'sim_data.sim')
+        subprocess.run(
+            [sys.executable, '-c', f'import benchmark; benchmark.write_baseline_pickle({pickle_path!r})'],
+            cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+        convert_sim_data.convert(pickle_path, solution_path)
+        converted = SimEngine(cache_path=solution_path)
+    assert converted.complete, 'converted baseline pickle was rejected'
+    for (state, details) in engine.state_details.items():
+        other = converted.state_details[state]
+        assert (other.in_progress, other.winner, other.value, other.optimal_play, dict(other.successors.items())) == (
+            details.in_progress, details.winner, details.value, details.optimal_play, dict(details.successors.items())), state
+
+def compare_symmetry(game_class=NoughtsAndCrosses):
+    for symmetry in (False, True):
+        with tempfile.TemporaryDirectory() as directory:
+            filename_base = os.path.join(directory, 'game')
+            start = perf_counter()
+            legacy_tracerise(game_class(), filename_base, symmetry)
+            build_time = perf_counter() - start
+            with open(filename_base + '_grammar.json') as f:
+                states = sum(key.startswith('*') for key in json.load(f))
+            sizes = [os.path.getsize(filename_base + suffix) for suffix in ('_grammar.json', '_replies.json')]
+        print(f'symmetry={symmetry}: {states} states, grammar {sizes[0]} bytes, replies {sizes[1]} bytes, {build_time:.1f}s')
+
+def legacy_make_grammar(game, filename, state_graph, displays, start_states, encode):
+    grammar = game.grammar()
+    for (state_code, options) in state_graph.items():
+        grammar['*'+state_code] = "[code:{}][options:{}]{}".format(state_code, '‚'.join(sorted(str(k) for k in options.keys())), displays[state_code])
+    grammar['origin'] = ["{}#*{}#".format(message, encode(state)) for (state, message) in start_states]
+    grammar['error'] = "Couldn't understand input. Reply in the format \"\\[code\\] \\[input\\]\"."
+    with open(filename, 'w') as f:
+        json.dump(grammar, f, indent='\t', sort_keys=True)
+
+def legacy_make_replies(filename, state_graph, encode):
+    states_sorted = sorted(state_graph.keys(), key = len, reverse=True)
+    replies = OrderedDict()
+    for state_code in states_sorted:
+        for (input, results) in state_graph[state_code].items():
+            reply = ''.join("[{}:{}]".format(
+                result_type,
+                ','.join('#*{}#'.format(encode(result)) for result in result_list))
+            for (result_type, result_list) in results.items())
+            replies['\\b{}\\b.*\\b{}\\b'.format(re.escape(state_code), re.escape(input))] = "{unlisted}" + reply + "#result#"
+    replies['.'] = "#error#"
+    with open(filename, 'w') as f:
+        json.dump(replies, f, indent='\t')
+
+def legacy_tracerise(game, filename_base, symmetry=False):
+    canonicalise = game.canonicalise if symmetry else (lambda state: state)
+    start_states = [(canonicalise(state), message) for (state, message) in game.start_states()]
+    state_graph = {}
+    displays = {}
+    state_queue = {state for (state, message) in start_states}
+    for _ in count():
+        state = state_queue.pop()
+        state_code = game.encode(state)
+        state_results = {}
+        if state_code not in state_graph:
+            displays[state_code] = game.display(state)
+        for option in game.options(state):
+            result_states = {
+                result_type: [canonicalise(result) for result in result_list]
+                for (result_type, result_list) in game.result(state, option).items()}
+            input = game.display_input(option)
+            state_results[input] = result_states
+            for result_state in chain.from_iterable(result_states.values()):
+                if game.encode(result_state) not in state_graph:
+                    state_queue.add(result_state)
+        state_graph[state_code] = state_results
+        if not state_queue:
+            break
+    legacy_make_grammar(game, filename_base+'_grammar.json', state_graph, displays, start_states, game.encode)
+    legacy_make_replies(filename_base+'_replies.json', state_graph, game.encode)
+
+games = {'sim': Sim, 'xo': NoughtsAndCrosses}
+
+def check_streaming_output(name):
+    game = games[name]()
+    start_states = list(game.start_states())
+    state_graph = {}
+    displays = {}
+    for (state_code, state, state_results) in game.explore(start_states, lambda state: state, MemoryFrontier(), game.encode):
+        state_graph[state_code] = state_results
+        displays[state_code] = game.display(state)
+    with tempfile.TemporaryDirectory() as directory:
+        legacy_base, streaming_base = os.path.join(directory, 'legacy'), os.path.join(directory, 'streaming')
+        legacy_make_grammar(game, legacy_base+'_grammar.json', state_graph, displays, start_states, game.encode)
+        legacy_make_replies(legacy_base+'_replies.json', state_graph, lambda code: code)
+        game.tracerise(streaming_base, compact_codes=False)
+        for suffix in ('_grammar.json', '_replies.json'):
+            assert filecmp.cmp(legacy_base+suffix, streaming_base+suffix, shallow=False), f'{name}{suffix} differs'
+
+def run_pipeline(name, pipeline, filename_base):
+    game = games[name]()
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tracemalloc.start()
+    start = perf_counter()
+    if pipeline == 'legacy':
+        legacy_tracerise(game, filename_base)
+    elif pipeline == 'disk':
+        game.tracerise(filename_base, visited_path=filename_base+'_visited.sqlite')
+    else:
+        game.tracerise(filename_base)
+    seconds = perf_counter() - start
+    heap_peak = tracemalloc.get_traced_memory()[1]
+    rss_growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline_rss
+    print(json.dumps({'seconds': seconds, 'heap_peak': heap_peak, 'rss_growth_kb': rss_growth}))
+
+def compare_pipelines():
+    for name in games:
+        check_streaming_output(name)
+        for pipeline in ('legacy', 'streaming', 'disk'):
+            with tempfile.TemporaryDirectory() as directory:
+                output = subprocess.run(
+                    [sys.executable, '-c', f'import benchmark; benchmark.run_pipeline({name!r}, {pipeline!r}, {os.path.join(directory, name)!r})'],
+                    capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+            result = json.loads(output.splitlines()[-1])
+            print(f"{name} {pipeline}: {result['seconds']:.2f}s, heap peak {result['heap_peak']/2**20:.2f} MiB, peak RSS {result['rss_growth_kb']/1024:.1f} MiB above imports")
+
+def check_codes(game, ranking):
+    for (code, state) in zip(ranking.encode_batch(ranking.states), ranking.states):
+        assert ranking.decode(code) == state
+        assert game.encode(game.decode(game.encode(state))) == game.encode(state)
+
+def compare_codes():
+    for (name, game_class) in games.items():
+        game = game_class()
+        sizes = {}
+        with tempfile.TemporaryDirectory() as directory:
+            for compact_codes in (False, True):
+                filename_base = os.path.join(directory, f'{name}_{compact_codes}')
+                ranking = game.tracerise(filename_base, compact_codes=compact_codes)
+                sizes[compact_codes] = [os.path.getsize(filename_base + suffix) for suffix in ('_grammar.json', '_replies.json')]
+        check_codes(game, ranking)
+        states = ranking.states
+        for encoder, encode in (('memoised', StateRanking(game.encode)), ('batch', StateRanking(game.encode).encode_batch)):
+            start = perf_counter()
+            encode(states) if encoder == 'batch' else [encode(state) for state in states]
+            first = perf_counter() - start
+            start = perf_counter()
+            encode(states) if encoder == 'batch' else [encode(state) for state in states]
+            print(f'{name} {encoder} encoder: {1e6*first/len(states):.2f}us/state cold, {1e6*(perf_counter()-start)/len(states):.2f}us/state warm')
+        start = perf_counter()
+        [game.encode(state) for state in states]
+        print(f'{name} base62 encoder: {1e6*(perf_counter()-start)/len(states):.2f}us/state')
+        for (i, suffix) in enumerate(('_grammar.json', '_replies.json')):
+            saved = sizes[False][i] - sizes[True][i]
+            print(f'{name}{suffix}: {sizes[False][i]} -> {sizes[True][i]} bytes, {saved} saved ({100*saved/sizes[False][i]:.1f}%)')
+
+common_words = ('ok', 'is', 'it', 'in', 'on', 'no', 'me', 'my', 'go', 'do', 'at', 'as', 'an', 'am', 'be', 'by', 'he', 'hi', 'if', 'of', 'or')
+
+def state_inputs(grammar_filename):
+    with open(grammar_filename) as f:
+        return {
+            key[1:]: re.match(r'\[code:[^\]]*\]\[options:([^\]]*)\]', value).group(1).split('‚')
+            for (key, value) in json.load(f).items() if key.startswith('*')}
+
+def check_routing(name):
+    game = games[name]()
+    with tempfile.TemporaryDirectory() as directory:
+        filename_base = os.path.join(directory, name)
+        game.tracerise(filename_base)
+        with open(filename_base + '_replies.json') as f:
+            positions = {pattern: position for (position, pattern) in enumerate(json.load(f))}
+        options = state_inputs(filename_base + '_grammar.json')
+    patterns = list(positions)
+    by_code = defaultdict(list)
+    for (code, inputs) in options.items():
+        for input in filter(None, inputs):
+            pattern = game.reply_entry(code, input, {})[0]
+            by_code[code].append((positions[pattern], re.compile(pattern)))
+    def first_match(message):
+        candidates = sorted(chain.from_iterable(by_code.get(word, ()) for word in set(re.findall(r'\w+', message))))
+        return next((patterns[position] for (position, pattern) in candidates if pattern.search(message)), patterns[-1])
+    misrouted = []
+    checked = 0
+    for (code, inputs) in options.items():
+        for input in filter(None, inputs):
+            expected = game.reply_entry(code, input, {})[0]
+            for word in ('',) + common_words:
+                message = f'@tracery_bot {word} {code} {input}'
+                checked += 1
+                if first_match(message) != expected:
+                    misrouted.append(message)
+    print(f'{name}: {checked} messages, {len(misrouted)} reached a state they did not name')
+    assert not misrouted, f'{name}: misrouted {misrouted[:5]}'
+
+def simulated_replies(grammar_filename, count=5000, seed=0):
+    options = state_inputs(grammar_filename)
+    rng = random.Random(seed)
+    codes = sorted(options)
+    messages = []
+    for _ in range(count):
+        code = rng.choice(codes)
+        inputs = [input for input in options[code] if input] or ['1']
+        kind = rng.random()
+        if kind < 0.8:
+            messages.append(f'@tracery_bot {code} {rng.choice(inputs)}')
+        elif kind < 0.9:
+            messages.append(f'@tracery_bot ok, {code} then {rng.choice(inputs)} please')
+        elif kind < 0.95:
+            messages.append(f'@tracery_bot {code} {rng.randint(10, 99)}')
+        else:
+            messages.append('@tracery_bot what are the rules?')
+    return messages
+
+def ambiguous_replies(grammar_filename, count=5000, seed=0):
+    options = state_inputs(grammar_filename)
+    rng = random.Random(seed)
+    codes = [code for code in sorted(options) if len(list(filter(None, options[code]))) > 1]
+    single_code = []
+    multiple_codes = []
+    for _ in range(count):
+        code, other = rng.sample(codes, 2)
+        inputs = rng.sample(list(filter(None, options[code])), 2)
+        other_input = rng.choice(list(filter(None, options[other])))
+        kind = rng.random()
+        if kind < 0.4:
+            single_code.append(f'@tracery_bot {code} {inputs[0]} or {inputs[1]}')
+        elif kind < 0.8:
+            single_code.append(f'@tracery_bot {code} {inputs[0]}, was {code} {inputs[1]}')
+        else:
+            multiple_codes.append(f'@tracery_bot {code} {inputs[0]}, was {other} {other_input}')
+    return single_code, multiple_codes
+
+def time_matcher(matcher, messages):
+    times = []
+    for message in messages:
+        start = perf_counter()
+        matcher.match(message)
+        times.append(perf_counter() - start)
+    times.sort()
+    return 1e6*sum(times)/len(times), 1e6*times[len(times)*99//100]
+
+def compare_replies(count=5000):
+    for (name, game_class) in games.items():
+        game = game_class()
+        with tempfile.TemporaryDirectory() as directory:
+            matchers = {}
+            for grouped in (False, True):
+                filename_base = os.path.join(directory, f'{name}_{grouped}')
+                game.tracerise(filename_base, grouped_replies=grouped)
+                matchers[grouped] = ReplyMatcher(filename_base+'_replies.json')
+                size = os.path.getsize(filename_base+'_replies.json')
+                if not grouped:
+                    messages = simulated_replies(filename_base+'_grammar.json', count)
+                mean, p99 = time_matcher(matchers[grouped], messages)
+                print(f'{name} grouped={grouped}: {len(matchers[grouped])} patterns, {size} bytes, {mean:.1f}us/message mean, {p99:.1f}us p99')
+            single_code, multiple_codes = ambiguous_replies(filename_base+'_grammar.json')
+        checked = messages + single_code + multiple_codes
+        mismatches = [message for message in checked if matchers[False].match(message) != matchers[True].match(message)]
+        assert not mismatches, f'{name}: grouped replies dispatch differently for {mismatches[:5]}'
+        print(f'{name}: all {len(checked)} messages agree, {len(multiple_codes)} of them naming two states')
+
+def check_server(name, count=500, seed=0):
+    game = games[name]()
+    service = ReplyService(game, seed)
+    with tempfile.TemporaryDirectory() as directory:
+        filename_base = os.path.join(directory, name)
+        game.tracerise(filename_base, compact_codes=False)
+        with open(filename_base + '_grammar.json') as f:
+            expander = Expander(json.load(f), rng=random.Random(seed))
+        matcher = ReplyMatcher(filename_base + '_replies.json')
+        messages = simulated_replies(filename_base + '_grammar.json', count, seed)
+    for message in messages:
+        assert service.reply(message) == expander.expand(matcher.match(message)), f'{name}: {message!r} replies differ'
+
+async def play_games(port, games_count, seed, latencies):
+    async def play(rng):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        async def request(message):
+            start = perf_counter()
+            writer.write((json.dumps(message) + '\n').encode())
+            await writer.drain()
+            reply = json.loads(await reader.readline())
+            latencies.append(perf_counter() - start)
+            return reply
+        reply = await request('')
+        while (match := re.search(r'Code: (\w+)\nOptions: ([^\n]*)', reply)):
+            reply = await request(f"@tracery_bot {match.group(1)} {rng.choice(match.group(2).split('‚'))}")
+        writer.close()
+        await writer.wait_closed()
+    await asyncio.gather(*(play(random.Random(seed + i)) for i in range(games_count)))
+
+async def load_test(game, games_count, seed, batch_size):
+    server = await ReplyService(game, seed, batch_size).serve()
+    latencies = []
+    async with server:
+        start = perf_counter()
+        await play_games(server.sockets[0].getsockname()[1], games_count, seed, latencies)
+        seconds = perf_counter() - start
+        server.worker.cancel()
+    return seconds, sorted(latencies)
+
+def compare_server(games_count=200, seed=0):
+    for name in games:
+        check_server(name)
+        game = games[name]()
+        for batch_size in (1, 64):
+            seconds, latencies = asyncio.run(load_test(game, games_count, seed, batch_size))
+            print(f'{name} batch_size={batch_size}: {games_count} concurrent games, {len(latencies)} requests, '
+                f'{len(latencies)/seconds:.0f} requests/s, p50 {1e3*latencies[len(latencies)//2]:.1f}ms, '
+                f'p99 {1e3*latencies[len(latencies)*99//100]:.1f}ms')
+
+def compare_rebuilds():
+    for (name, game_class) in games.items():
+        game = game_class()
+        with tempfile.TemporaryDirectory() as directory:
+            filename_base = os.path.join(directory, name)
+            game.tracerise(filename_base + '_reference')
+            times = []
+            for _ in range(2):
+                start = perf_counter()
+                game.tracerise(filename_base, build_path=filename_base + '_build.sqlite')
+                times.append(perf_counter() - start)
+            for suffix in ('_grammar.json', '_replies.json'):
+                assert filecmp.cmp(filename_base + '_reference' + suffix, filename_base + suffix, shallow=False), f'{name}{suffix} differs'
+        print(f'{name}: {times[0]:.2f}s cached build, {times[1]:.2f}s rebuild from the cached state graph')
+
+def profile_builds(processes=1):
+    with Metrics(SummarySink(sys.stdout)) as metrics:
+        engine = SimEngine(processes, cache_path=None, metrics=metrics)
+        engine.map_state_space()
+        engine.perform_minimax()
+        canonicaliser = IsomorphismCanonicaliser(engine, metrics)
+        for state in generated_states(engine):
+            canonicaliser.canonicalise(state)
+    for (name, game_class) in games.items():
+        print(name)
+        with Metrics(SummarySink(sys.stdout)) as metrics, tempfile.TemporaryDirectory() as directory:
+            game_class().tracerise(os.path.join(directory, name), metrics=metrics)
+
+def reachable_states(game):
+    states = [state for (state, message) in game.start_states()]
+    seen = set(map(game.encode, states))
+    for state in states:
+        for option in game.options(state):
+            for result_state in chain.from_iterable(game.result(state, option).values()):
+                if game.encode(result_state) not in seen:
+                    seen.add(game.encode(result_state))
+                    states.append(result_state)
+    return states
+
+def explored_graph(game):
+    start_states = [(game.canonicalise(state), message) for (state, message) in game.start_states()]
+    state_graph = {}
+    displays = {}
+    for (state_code, state, state_results) in game.explore(start_states, game.canonicalise, MemoryFrontier(), game.encode):
+        state_graph[state_code] = {
+            input: {result_type: [game.decode(code) for code in codes] for (result_type, codes) in results.items()}
+            for (input, results) in state_results.items()}
+        displays[state_code] = game.display(state)
+    return start_states, state_graph, displays
+
+def time_cold_load():
+    engine = SimEngine(cache_path=None)
+    engine.cache_path = default_cache_path
+    start = perf_counter()
+    engine.load_data()
+    engine.state_details[SimState.initial_state()].optimal_play
+    print(json.dumps({'seconds': perf_counter() - start}))
+
+def cold_load():
+    output = subprocess.run(
+        [sys.executable, '-c', 'import benchmark; benchmark.time_cold_load()'],
+        capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+    return json.loads(output.splitlines()[-1])['seconds']
+
+def suite_phases(directory, seed=0, samples=2000):
+    rng = random.Random(seed)
+    solved = SimEngine()
+    solved.map_state_space()
+    solved.perform_minimax()
+    sim_states = generated_states(solved)
+    sim_states = rng.sample(sim_states, min(samples, len(sim_states)))
+    mapped = SimEngine(cache_path=None)
+    mapped.map_state_space()
+    root = mapped.state_details.ids[SimState.initial_state()]
+    xo = NoughtsAndCrosses()
+    xo_moves = [(state, option) for state in reachable_states(xo) for option in xo.options(state)]
+    xo_moves = rng.sample(xo_moves, min(samples, len(xo_moves)))
+    def fresh_engine():
+        engine = SimEngine(cache_path=None)
+        return lambda: engine.map_state_space()
+    def reset_minimax():
+        reset_solution(mapped)
+        return lambda: mapped.minimax(root)
+    def reset_retrograde():
+        reset_solution(mapped)
+        mapped.complete = False
+        return lambda: mapped.perform_minimax()
+    def warm_load():
+        solved.complete = False
+        return lambda: (solved.load_data(), solved.state_details[SimState.initial_state()].optimal_play)
+    phases = {
+        'sim.canonicalise': lambda: lambda: [solved.canonicalise(state) for state in sim_states],
+        'sim.map_state_space': fresh_engine,
+        'sim.minimax': reset_minimax,
+        'sim.retrograde': reset_retrograde,
+        'sim.load_data.cold': None,
+        'sim.load_data.warm': warm_load,
+        'xo.result': lambda: lambda: [xo.result(state, option) for (state, option) in xo_moves],
+    }
+    for (name, game_class) in games.items():
+        game = xo if name == 'xo' else game_class()
+        start_states, state_graph, displays = explored_graph(game)
+        filename_base = os.path.join(directory, name)
+        phases[f'{name}.tracerise'] = lambda game=game, filename_base=filename_base: lambda: game.tracerise(filename_base)
+        phases[f'{name}.make_grammar'] = lambda game=game, filename_base=filename_base, graph=(state_graph, displays, start_states): \
+            lambda: game.make_grammar(filename_base+'_grammar.json', *graph)
+        phases[f'{name}.make_replies'] = lambda game=game, filename_base=filename_base, state_graph=state_graph: \
+            lambda: game.make_replies(filename_base+'_replies.json', state_graph)
+    return phases
+
+def run_phase(setup, repeats):
+    times = []
+    for _ in range(repeats):
+        run = setup()
+        start = perf_counter()
+        run()
+        times.append(perf_counter() - start)
+    return times
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_suite(repeats=5, seed=0, samples=2000, only=None):
+    results = {'revision': git_revision(), 'python': sys.version.split()[0], 'seed': seed, 'repeats': repeats, 'phases': {}}
+    with tempfile.TemporaryDirectory() as directory:
+        for (name, setup) in suite_phases(directory, seed, samples).items():
+            if only and not any(name.startswith(prefix) for prefix in only):
+                continue
+            times = [cold_load() for _ in range(repeats)] if setup is None else run_phase(setup, repeats)
+            times.sort()
+            results['phases'][name] = {'min': times[0], 'median': times[len(times)//2], 'max': times[-1]}
+    return results
+
+def regressions(results, baseline, threshold=0.25):
+    slower = {}
+    for (name, timings) in results['phases'].items():
+        if name in baseline['phases']:
+            ratio = timings['min'] / baseline['phases'][name]['min']
+            if ratio > 1 + threshold:
+                slower[name] = ratio
+    return slower
+
+def suite_main(arguments):
+    import argparse
+    parser = argparse.ArgumentParser(prog='benchmark.py suite')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--baseline', help='results JSON from an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=0.25, help='fail if a phase is this fraction slower than the baseline')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--samples', type=int, default=2000)
+    parser.add_argument('--only', nargs='*', help='run only phases starting with these prefixes')
+    args = parser.parse_args(arguments)
+    results = run_suite(args.repeats, args.seed, args.samples, args.only)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    for (name, timings) in results['phases'].items():
+        line = f"{name:24} {1e3*timings['min']:10.3f}ms min {1e3*timings['median']:10.3f}ms median"
+        if baseline and name in baseline['phases']:
+            line += f" {timings['min']/baseline['phases'][name]['min']:6.2f}x baseline"
+        print(line)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent='\t', sort_keys=True)
+    if baseline:
+        slower = regressions(results, baseline, args.threshold)
+        if slower:
+            sys.exit('Regressions beyond {:.0%}: {}'.format(args.threshold, ', '.join(
+                f'{name} {ratio:.2f}x' for (name, ratio) in sorted(slower.items()))))
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['suite']:
+        suite_main(sys.argv[2:])
+        sys.exit()
+    compare_canonicalisers()
+    compare_invariants()
+    compare_stores()
+    compare_solvers()
+    compare_queries()
+    compare_ramsey()
+    compare_batches()
+    compare_explorers()
+    compare_loading()
+    check_corruption()
+    check_conversion()
+    compare_symmetry()
+    compare_pipelines()
+    compare_codes()
+    compare_replies()
+    check_routing('sim')
+    check_routing('xo')
+    compare_server()
+    compare_rebuilds()
+    profile_builds()
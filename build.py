@@ -0,0 +1,114 @@
+import argparse
+import ast
+import hashlib
+import importlib
+import json
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from time import perf_counter
+
+directory = os.path.dirname(os.path.abspath(__file__))
+suffixes = ('_grammar.json', '_replies.json')
+
+def module_path(module):
+    return os.path.join(directory, module + '.py')
+
+def parse_module(module):
+    with open(module_path(module), 'rb') as f:
+        return ast.parse(f.read(), module_path(module))
+
+def local_imports(tree):
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            yield from (alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            yield node.module
+
+def dependencies(module):
+    seen = set()
+    pending = [module]
+    while pending:
+        module = pending.pop()
+        if module in seen or not os.path.exists(module_path(module)):
+            continue
+        seen.add(module)
+        pending.extend(local_imports(parse_module(module)))
+    return sorted(seen)
+
+def discover():
+    games = []
+    for filename in sorted(os.listdir(directory)):
+        module = filename[:-3]
+        if not filename.endswith('.py') or module == 'build':
+            continue
+        for node in parse_module(module).body:
+            if isinstance(node, ast.ClassDef) and any(isinstance(base, ast.Name) and base.id == 'Game' for base in node.bases):
+                games.append((module, node.name))
+    return games
+
+def game_class(module, class_name):
+    return getattr(importlib.import_module(module), class_name)
+
+def build_digest(module, class_name, options):
+    digest = hashlib.sha256()
+    for dependency in dependencies(module):
+        with open(module_path(dependency), 'rb') as f:
+            digest.update(dependency.encode() + b'\0' + hashlib.sha256(f.read()).digest())
+    cls = game_class(module, class_name)
+    digest.update(json.dumps([module, class_name, list(cls.build_arguments), options], sort_keys=True).encode())
+    return digest.hexdigest()
+
+def build_game(module, class_name, output_directory, cache_directory, options, force=False):
+    start = perf_counter()
+    cls = game_class(module, class_name)
+    name = cls.name or module
+    digest = build_digest(module, class_name, options)
+    cached = os.path.join(cache_directory, digest)
+    status = 'cached'
+    if force or not all(os.path.exists(os.path.join(cached, name + suffix)) for suffix in suffixes):
+        status = 'built'
+        staging = f'{cached}.{os.getpid()}.tmp'
+        os.makedirs(staging, exist_ok=True)
+        cls(*cls.build_arguments).tracerise(
+            os.path.join(staging, name), build_path=os.path.join(staging, 'state_graph.sqlite'), **options)
+        shutil.rmtree(cached, ignore_errors=True)
+        os.replace(staging, cached)
+    os.makedirs(output_directory, exist_ok=True)
+    sizes = []
+    for suffix in suffixes:
+        shutil.copyfile(os.path.join(cached, name + suffix), os.path.join(output_directory, name + suffix))
+        sizes.append(os.path.getsize(os.path.join(output_directory, name + suffix)))
+    return {'game': name, 'status': status, 'seconds': perf_counter() - start, 'grammar_bytes': sizes[0], 'replies_bytes': sizes[1], 'digest': digest}
+
+def build_all(output_directory='.', cache_directory=os.path.join(directory, '.build_cache'), processes=None, names=None,
+        force=False, options=None):
+    options = options or {}
+    games = [
+        (module, class_name) for (module, class_name) in discover()
+        if not names or (game_class(module, class_name).name or module) in names]
+    reports = []
+    with ProcessPoolExecutor(processes) as pool:
+        futures = [
+            pool.submit(build_game, module, class_name, output_directory, cache_directory, options, force)
+            for (module, class_name) in games]
+        for future in as_completed(futures):
+            report = future.result()
+            print(f"{report['game']:12} {report['status']:7} {report['seconds']:8.2f}s "
+                f"grammar {report['grammar_bytes']:9} bytes, replies {report['replies_bytes']:9} bytes")
+            reports.append(report)
+    return reports
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build every game into Tracery grammar and replies files.')
+    parser.add_argument('names', nargs='*', help='build only these games')
+    parser.add_argument('--output', default='.', help='directory for the JSON files')
+    parser.add_argument('--cache', default=os.path.join(directory, '.build_cache'), help='directory for cached builds')
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--force', action='store_true', help='rebuild even if a cached build exists')
+    parser.add_argument('--grouped-replies', action='store_true',
+        help="merge each state's reply patterns by reply")
+    args = parser.parse_args()
+    start = perf_counter()
+    build_all(args.output, args.cache, args.processes, args.names, args.force, {'grouped_replies': args.grouped_replies})
+    print(f'{perf_counter() - start:.2f}s total')
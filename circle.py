@@ -1,18 +1,29 @@
 from game import Game
 
 class Circle(Game):
+    name = 'circle'
+    build_arguments = (15,)
     def __init__(self, n):
         self.n = n
-    def start_state(self):
-        return 0
+    def start_states(self):
+        return [(0, "Let's go round in circles.\n")]
     def options(self, state):
         return ['+', '-']
     def result(self, state, input):
-        return (state + {'+':1, '-':-1}[input])%self.n
+        return {'only': [(state + {'+':1, '-':-1}[input])%self.n]}
     def display(self, state):
-        return 'state: ' + str(state)
+        return 'state: ' + str(state) + '#display#'
     def encode(self, state):
         return str(state)
+    def decode(self, code):
+        return int(code)
+    def grammar(self):
+        return {
+            'display': "\nCode: #code#\nOptions: #options#",
+            'result': '#only#',
+        }
+    def display_input(self, input):
+        return {'+':'up', '-':'down'}[input]
 
 if __name__ == '__main__':
     Circle(15).tracerise('circle')
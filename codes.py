@@ -0,0 +1,76 @@
+from math import prod
+from string import ascii_letters, digits
+import numpy
+
+ALPHABETS = (ascii_letters, digits)
+MIN_LENGTH = 2
+
+def alphabet(position):
+    return ALPHABETS[position % len(ALPHABETS)]
+
+def code_count(length):
+    return prod(len(alphabet(position)) for position in range(length))
+
+def rank_code(rank):
+    length = MIN_LENGTH
+    while rank >= code_count(length):
+        rank -= code_count(length)
+        length += 1
+    characters = []
+    for position in reversed(range(length)):
+        rank, index = divmod(rank, len(alphabet(position)))
+        characters.append(alphabet(position)[index])
+    return ''.join(reversed(characters))
+
+def code_rank(code):
+    if len(code) < MIN_LENGTH:
+        raise ValueError(f'{code!r} is too short to be a state code')
+    rank = sum(code_count(length) for length in range(MIN_LENGTH, len(code)))
+    offset = 0
+    for (position, character) in enumerate(code):
+        offset = offset * len(alphabet(position)) + alphabet(position).index(character)
+    return rank + offset
+
+def rank_codes(ranks):
+    ranks = numpy.asarray(ranks, dtype=numpy.int64)
+    codes = numpy.empty(len(ranks), dtype=object)
+    length, first = MIN_LENGTH, 0
+    while (ranks >= first).any():
+        count = code_count(length)
+        chosen = numpy.flatnonzero((ranks >= first) & (ranks < first + count))
+        offsets = ranks[chosen] - first
+        columns = []
+        for position in reversed(range(length)):
+            offsets, indices = numpy.divmod(offsets, len(alphabet(position)))
+            columns.append(numpy.array(list(alphabet(position)))[indices])
+        codes[chosen] = [''.join(row) for row in zip(*reversed(columns))]
+        length, first = length + 1, first + count
+    return codes.tolist()
+
+class StateRanking:
+    def __init__(self, encode):
+        self.encode = encode
+        self.ranks = {}
+        self.states = []
+        self.codes = {}
+    def rank(self, state):
+        key = self.encode(state)
+        try:
+            return self.ranks[key]
+        except KeyError:
+            self.ranks[key] = len(self.states)
+            self.states.append(state)
+            return self.ranks[key]
+    def __call__(self, state):
+        try:
+            return self.codes[state]
+        except KeyError:
+            code = self.codes[state] = rank_code(self.rank(state))
+            return code
+    def encode_batch(self, states):
+        missing = [state for state in dict.fromkeys(states) if state not in self.codes]
+        for (state, code) in zip(missing, rank_codes([self.rank(state) for state in missing])):
+            self.codes[state] = code
+        return [self.codes[state] for state in states]
+    def decode(self, code):
+        return self.states[code_rank(code)]
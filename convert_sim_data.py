@@ -0,0 +1,87 @@
+import io
+import pickle
+import sys
+from dataclasses import dataclass, field
+from typing import NamedTuple, Tuple, Optional, Dict
+from sim_engine import SimEngine, SimState, StateStore, Colour, Player, default_cache_path
+from sim_solution import write_solution
+
+class LegacySimState(NamedTuple):
+    player: Player
+    colours: Tuple[Colour, ...]
+
+class LegacyStateInvariants(NamedTuple):
+    player: Player
+    degree_sequence: Tuple[Tuple[int, int], ...]
+
+@dataclass
+class LegacyStateDetails:
+    expanded: bool = False
+    in_progress: Optional[bool] = None
+    winner: Optional[Player] = None
+    value: Optional[int] = None
+    optimal_play: Optional[int] = None
+    successors: Dict[int, LegacySimState] = field(default_factory=dict)
+
+class EngineUnpickler(pickle.Unpickler):
+    def find_class(self, module, name):
+        if module == '__main__':
+            module = 'sim_engine'
+        return super().find_class(module, name)
+
+class LegacyUnpickler(EngineUnpickler):
+    legacy_classes = {
+        'SimState': LegacySimState, 'StateDetails': LegacyStateDetails, 'StateInvariants': LegacyStateInvariants}
+    def find_class(self, module, name):
+        if module in ('__main__', 'sim_engine') and name in self.legacy_classes:
+            return self.legacy_classes[name]
+        return super().find_class(module, name)
+
+def packed_state(legacy_state):
+    red = sum(1 << e for (e, c) in enumerate(legacy_state.colours) if c is Colour.red)
+    blue = sum(1 << e for (e, c) in enumerate(legacy_state.colours) if c is Colour.blue)
+    player = SimState.player_bit if legacy_state.player is Player.blue else 0
+    return SimState(player | red << SimState.edge_count | blue)
+
+def convert_legacy(engine, state_details):
+    if any(details.value is None for details in state_details.values()):
+        raise ValueError('pickle does not hold a fully solved state graph')
+    canonical = {}
+    for legacy_state in state_details:
+        key, permutation = engine.canonical_permutation(packed_state(legacy_state))
+        canonical[legacy_state] = (engine.state_from_key(key), permutation)
+    coloured = SimState.player_bit - 1
+    order = sorted(canonical, key=lambda legacy_state: (
+        (canonical[legacy_state][0] & coloured).bit_count(), canonical[legacy_state][0]))
+    store = StateStore(len(order))
+    ids = {legacy_state: store.add(canonical[legacy_state][0]) for legacy_state in order}
+    for (legacy_state, state_id) in ids.items():
+        details = state_details[legacy_state]
+        relabel = engine.edge_permutations[canonical[legacy_state][1]]
+        store.in_progress[state_id] = details.in_progress
+        store.value[state_id] = details.value
+        if details.winner is not None:
+            store.winner[state_id] = details.winner.value
+        if details.optimal_play is not None:
+            store.optimal_play[state_id] = relabel[details.optimal_play]
+        for (option, next_state) in details.successors.items():
+            store.successors[state_id, relabel[option]] = ids[next_state]
+    return store
+
+def load_pickle(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    try:
+        return EngineUnpickler(io.BytesIO(data)).load()
+    except Exception:
+        return LegacyUnpickler(io.BytesIO(data)).load()
+
+def convert(pickle_path='sim_data.pck', solution_path=default_cache_path):
+    engine = SimEngine(cache_path=None)
+    loaded = load_pickle(pickle_path)
+    store = loaded if isinstance(loaded, StateStore) else convert_legacy(engine, loaded[-1])
+    write_solution(solution_path, engine.parameters_digest(), store.to_arrays())
+    print(f'Converted {len(store)} states from {pickle_path} to {solution_path}')
+
+if __name__ == '__main__':
+    convert(*sys.argv[1:])
@@ -0,0 +1,121 @@
+import random
+import re
+from functools import lru_cache
+
+tokens = re.compile(r'[\\\[\]#,]')
+openings = re.compile(r'[\\\[#]')
+
+class Literal(str):
+    pass
+
+def closing(text, start, close):
+    i = start
+    while (match := tokens.search(text, i)) is not None:
+        i = match.start()
+        character = text[i]
+        if character == '\\':
+            i += 2
+        elif character == close:
+            return i
+        elif character == '[':
+            i = closing(text, i + 1, ']') + 1
+        elif character == '#':
+            i = closing(text, i + 1, '#') + 1
+        else:
+            i += 1
+    raise ValueError(f'unclosed {close!r} in {text!r}')
+
+@lru_cache(maxsize=1 << 16)
+def parse(rule):
+    sections = []
+    i = 0
+    while (match := openings.search(rule, i)) is not None:
+        start = match.start()
+        character = rule[start]
+        sections.append(('text', rule[i:start]))
+        if character == '\\':
+            sections.append(('text', rule[start + 1:start + 2]))
+            i = start + 2
+        elif character == '[':
+            end = closing(rule, start + 1, ']')
+            sections.append(('action', rule[start + 1:end]))
+            i = end + 1
+        else:
+            end = closing(rule, start + 1, '#')
+            sections.append(('tag', rule[start + 1:end]))
+            i = end + 1
+    sections.append(('text', rule[i:]))
+    return tuple((kind, text) for (kind, text) in sections if text or kind != 'text')
+
+@lru_cache(maxsize=1 << 16)
+def split_rules(text):
+    rules = []
+    start = i = 0
+    while (match := tokens.search(text, i)) is not None:
+        i = match.start()
+        character = text[i]
+        if character == '\\':
+            i += 2
+        elif character == '[':
+            i = closing(text, i + 1, ']') + 1
+        elif character == '#':
+            i = closing(text, i + 1, '#') + 1
+        elif character == ',':
+            rules.append(text[start:i])
+            start = i = i + 1
+        else:
+            i += 1
+    rules.append(text[start:])
+    return tuple(rules)
+
+class Expander:
+    def __init__(self, grammar, missing=None, rng=None):
+        self.grammar = grammar
+        self.missing = missing
+        self.rng = rng or random.Random()
+    def rules(self, symbol, stack):
+        if stack.get(symbol):
+            return stack[symbol][-1]
+        if symbol in self.grammar:
+            return self.grammar[symbol]
+        if self.missing is not None:
+            return self.missing(symbol)
+        return None
+    def action(self, text, stack):
+        key, separator, value = text.partition(':')
+        if not separator:
+            return key
+        if value == 'POP':
+            if stack.get(key):
+                stack[key].pop()
+            return key
+        stack.setdefault(key, []).append([Literal(self.expand(rule, stack)) for rule in split_rules(value)])
+        return key
+    def tag(self, text, stack):
+        pushed = []
+        while text.startswith('['):
+            end = closing(text, 1, ']')
+            pushed.append(self.action(text[1:end], stack))
+            text = text[end + 1:]
+        symbol = text.split('.')[0]
+        rules = self.rules(symbol, stack)
+        if rules is None:
+            expansion = f'(({symbol}))'
+        else:
+            rule = self.rng.choice(rules) if isinstance(rules, list) else rules
+            expansion = rule if isinstance(rule, Literal) else self.expand(rule, stack)
+        for key in pushed:
+            if stack.get(key):
+                stack[key].pop()
+        return expansion
+    def expand(self, rule, stack=None):
+        stack = {} if stack is None else stack
+        output = []
+        for (kind, text) in parse(rule):
+            if kind == 'text':
+                output.append(text)
+            elif kind == 'action':
+                self.action(text, stack)
+            else:
+                output.append(self.tag(text, stack))
+        return ''.join(output)
@@ -1,11 +1,13 @@
 from abc import ABCMeta, abstractmethod
-import json
 import re
-from collections import OrderedDict
-from tqdm import tqdm
-from itertools import count, chain
+from time import perf_counter
+from pipeline import MemoryFrontier, DiskFrontier, BuildCache, SortedJSONWriter, BucketedJSONWriter, GroupedJSONWriter
+from codes import StateRanking
+from metrics import null_metrics
 
 class Game(metaclass=ABCMeta):
+    name = None
+    build_arguments = ()
     def __init__(self):
         pass
     @abstractmethod
@@ -29,49 +31,121 @@ class Game(metaclass=ABCMeta):
     @abstractmethod
     def display_input(self, input):
         pass
-    def make_grammar(self, filename, state_graph, displays):
+    def canonicalise(self, state):
+        return state
+    def prepare(self, states):
+        pass
+    def grammar_entry(self, state_code, inputs, display):
+        return "[code:{}][options:{}]{}".format(state_code, '‚'.join(sorted(str(k) for k in inputs)), display)
+    def reply_value(self, result_codes):
+        reply = ''.join("[{}:{}]".format(
+            result_type,
+            ','.join('#*{}#'.format(result_code) for result_code in result_list))
+        for (result_type, result_list) in result_codes.items())
+        return "{unlisted}" + reply + "#result#"
+    def reply_entry(self, state_code, input, result_codes):
+        return '\\b{}\\b.*\\b{}\\b'.format(re.escape(state_code), re.escape(input)), self.reply_value(result_codes)
+    def grouped_reply_entry(self, state_code, input, result_codes):
+        return (state_code, input), self.reply_value(result_codes)
+    def reply_pattern(self, members):
+        alternation = lambda words: words[0] if len(words) == 1 else '(?:{})'.format('|'.join(words))
+        return '\\b{}\\b'.format(alternation([
+            '{}\\b.*\\b{}'.format(re.escape(code), alternation([re.escape(input) for input in inputs]))
+            for (code, inputs) in members.items()]))
+    def grammar_writer(self, filename, start_states, encode=None):
+        encode = encode or self.encode
+        writer = SortedJSONWriter(filename)
         grammar = self.grammar()
-        for (state_code, options) in state_graph.items():
-            grammar['*'+state_code] = "[code:{}][options:{}]{}".format(state_code, '‚'.join(sorted(str(k) for k in options.keys())), displays[state_code])
-        grammar['origin'] = ["{}#*{}#".format(message, self.encode(state)) for (state, message) in self.start_states()]
+        grammar['origin'] = ["{}#*{}#".format(message, encode(state)) for (state, message) in start_states]
         grammar['error'] = "Couldn't understand input. Reply in the format \"\\[code\\] \\[input\\]\"."
-        with open(filename, 'w') as f:
-            json.dump(grammar, f, indent='\t', sort_keys=True)
-    def make_replies(self, filename, state_graph):
-        states_sorted = sorted(state_graph.keys(), key = len, reverse=True)
-        replies = OrderedDict()
-        for state_code in states_sorted:
-            for (input, results) in state_graph[state_code].items():
-                reply = ''.join("[{}:{}]".format(
-                    result_type,
-                    ','.join('#*{}#'.format(self.encode(result)) for result in result_list))
-                for (result_type, result_list) in results.items())
-                replies['\\b{}\\b.*\\b{}\\b'.format(re.escape(state_code), re.escape(input))] = "{unlisted}" + reply + "#result#"
-        replies['.'] = "#error#"
-        with open(filename, 'w') as f:
-            json.dump(replies, f, indent='\t')
-    def tracerise(self, filename_base):
-        state_graph = {}
-        displays = {}
-        state_queue = {state for (state, message) in self.start_states()}
-        for _ in tqdm(count()):
-            state = state_queue.pop()
-            state_code = self.encode(state)
+        for (key, value) in grammar.items():
+            writer.add(key, value)
+        return writer
+    def replies_writer(self, filename, grouped=False):
+        if grouped:
+            return GroupedJSONWriter(filename, ('.', "#error#"), self.reply_pattern)
+        return BucketedJSONWriter(filename, ('.', "#error#"))
+    def make_grammar(self, filename, state_graph, displays, start_states=None):
+        if start_states is None:
+            start_states = self.start_states()
+        with self.grammar_writer(filename, start_states) as writer:
+            for (state_code, options) in state_graph.items():
+                writer.add('*'+state_code, self.grammar_entry(state_code, options.keys(), displays[state_code]))
+    def make_replies(self, filename, state_graph, grouped=False):
+        entry = self.grouped_reply_entry if grouped else self.reply_entry
+        with self.replies_writer(filename, grouped) as writer:
+            for (state_code, state_results) in state_graph.items():
+                for (input, results) in state_results.items():
+                    result_codes = {
+                        result_type: [self.encode(result) for result in result_list]
+                        for (result_type, result_list) in results.items()}
+                    writer.add(len(state_code), *entry(state_code, input, result_codes))
+    def explore(self, start_states, canonicalise, frontier, encode=None, metrics=null_metrics, batch_size=256):
+        encode = encode or self.encode
+        for (state, message) in start_states:
+            frontier.push(encode(state), state)
+        while frontier:
+            metrics.observe('tracerise.frontier', len(frontier))
+            with metrics.timer('tracerise.prepare'):
+                batch = frontier.pop_batch(batch_size)
+                self.prepare(batch)
+            for state in batch:
+                yield self.explore_state(state, canonicalise, frontier, encode, metrics)
+    def explore_state(self, state, canonicalise, frontier, encode, metrics=null_metrics):
+        with metrics.timer('tracerise.explore'):
             state_results = {}
-            if state_code not in state_graph:
-                state_display = self.display(state)
-                displays[state_code] = state_display
             for option in self.options(state):
-                result_states = self.result(state, option)
+                result_codes = {}
+                for (result_type, result_list) in self.result(state, option).items():
+                    result_codes[result_type] = []
+                    for result_state in map(canonicalise, result_list):
+                        result_code = encode(result_state)
+                        result_codes[result_type].append(result_code)
+                        if not frontier.push(result_code, result_state):
+                            metrics.count('tracerise.revisits')
+                        metrics.count('tracerise.results')
                 input = self.display_input(option)
                 assert input not in state_results, 'input collision'
-                state_results[input] = result_states
-                for result_state in chain.from_iterable(result_states.values()):
-                    result_code = self.encode(result_state)
-                    if result_code not in state_graph:
-                        state_queue.add(result_state)
-            state_graph[state_code] = state_results
-            if not state_queue:
-                break
-        self.make_grammar(filename_base+'_grammar.json', state_graph, displays)
-        self.make_replies(filename_base+'_replies.json', state_graph)
+                state_results[input] = result_codes
+            metrics.count('tracerise.states')
+            metrics.count('tracerise.options', len(state_results))
+        return encode(state), state, state_results
+    def write_state(self, grammar, replies, entry, state_code, state, state_results, metrics=null_metrics):
+        with metrics.timer('tracerise.display'):
+            display = self.display(state)
+        with metrics.timer('tracerise.write'):
+            grammar.add('*'+state_code, self.grammar_entry(state_code, state_results.keys(), display))
+            for (input, result_codes) in state_results.items():
+                replies.add(len(state_code), *entry(state_code, input, result_codes))
+    def tracerise(self, filename_base, visited_path=None, compact_codes=True, grouped_replies=False,
+            metrics=null_metrics, build_path=None, checkpoint_interval=60, batch_size=256):
+        canonicalise = lambda state: state
+        encode = StateRanking(self.encode) if compact_codes else self.encode
+        entry = self.grouped_reply_entry if grouped_replies else self.reply_entry
+        start_states = list(self.start_states())
+        if build_path:
+            settings = {'game': type(self).__qualname__, 'compact_codes': compact_codes}
+            frontier = BuildCache(build_path, settings, checkpoint_interval)
+        else:
+            frontier = DiskFrontier(visited_path) if visited_path else MemoryFrontier()
+        try:
+            if build_path:
+                if compact_codes:
+                    for state in frontier.states():
+                        encode(state)
+                for (state_code, state, state_results) in self.explore(start_states, canonicalise, frontier, encode, metrics, batch_size):
+                    frontier.record(state_code, state_results)
+                frontier.checkpoint()
+            with self.grammar_writer(filename_base+'_grammar.json', start_states, encode) as grammar, \
+                    self.replies_writer(filename_base+'_replies.json', grouped_replies) as replies:
+                if build_path:
+                    states = frontier.items()
+                else:
+                    states = self.explore(start_states, canonicalise, frontier, encode, metrics, batch_size)
+                for (state_code, state, state_results) in states:
+                    self.write_state(grammar, replies, entry, state_code, state, state_results, metrics)
+                merge_start = perf_counter()
+            metrics.time('tracerise.merge', perf_counter() - merge_start)
+        finally:
+            frontier.close()
+        return encode
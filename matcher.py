@@ -0,0 +1,14 @@
+import json
+import re
+
+class ReplyMatcher:
+    def __init__(self, filename):
+        with open(filename) as f:
+            self.replies = [(re.compile(pattern), value) for (pattern, value) in json.load(f).items()]
+    def __len__(self):
+        return len(self.replies)
+    def match(self, message):
+        for (pattern, value) in self.replies:
+            if pattern.search(message):
+                return value
+        return None
@@ -0,0 +1,120 @@
+import json
+import sys
+from collections import defaultdict
+from contextlib import nullcontext
+from time import perf_counter
+
+class Timer:
+    __slots__ = ('metrics', 'name', 'start')
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.time(self.name, perf_counter() - self.start)
+
+null_timer = nullcontext()
+
+class NullMetrics:
+    enabled = False
+    def count(self, name, value=1):
+        pass
+    def observe(self, name, value):
+        pass
+    def time(self, name, seconds):
+        pass
+    def timer(self, name):
+        return null_timer
+    def close(self):
+        pass
+    def __enter__(self):
+        return self
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+null_metrics = NullMetrics()
+
+class Metrics(NullMetrics):
+    enabled = True
+    def __init__(self, *sinks):
+        self.sinks = sinks
+    def count(self, name, value=1):
+        for sink in self.sinks:
+            sink.record('count', name, value)
+    def observe(self, name, value):
+        for sink in self.sinks:
+            sink.record('observe', name, value)
+    def time(self, name, seconds):
+        for sink in self.sinks:
+            sink.record('time', name, seconds)
+    def timer(self, name):
+        return Timer(self, name)
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+class JSONLinesSink:
+    def __init__(self, filename):
+        self.file = open(filename, 'w')
+        self.start = perf_counter()
+    def record(self, kind, name, value):
+        self.file.write(json.dumps({'elapsed': perf_counter() - self.start, 'kind': kind, 'name': name, 'value': value}) + '\n')
+    def close(self):
+        self.file.close()
+
+def histogram(values):
+    buckets = defaultdict(int)
+    for value in values:
+        buckets[1 << max(int(value) - 1, 0).bit_length()] += 1
+    return dict(sorted(buckets.items()))
+
+class SummarySink:
+    def __init__(self, stream=sys.stderr):
+        self.stream = stream
+        self.counts = defaultdict(int)
+        self.observations = defaultdict(list)
+        self.times = defaultdict(list)
+    def record(self, kind, name, value):
+        if kind == 'count':
+            self.counts[name] += value
+        elif kind == 'observe':
+            self.observations[name].append(value)
+        else:
+            self.times[name].append(value)
+    def table(self):
+        lines = []
+        if self.times:
+            lines.append(f"{'timer':32} {'calls':>10} {'total s':>10} {'mean us':>10}")
+            for (name, times) in sorted(self.times.items(), key=lambda item: -sum(item[1])):
+                lines.append(f'{name:32} {len(times):10} {sum(times):10.3f} {1e6*sum(times)/len(times):10.1f}')
+        if self.counts:
+            lines.append(f"{'counter':32} {'total':>10}")
+            for (name, total) in sorted(self.counts.items()):
+                lines.append(f'{name:32} {total:10}')
+        if self.observations:
+            lines.append(f"{'histogram':32} {'n':>10} {'min':>10} {'mean':>10} {'max':>10}  buckets (<=)")
+            for (name, values) in sorted(self.observations.items()):
+                buckets = ' '.join(f'{bound}:{n}' for (bound, n) in histogram(values).items())
+                lines.append(f'{name:32} {len(values):10} {min(values):10} {sum(values)/len(values):10.1f} {max(values):10}  {buckets}')
+        return '\n'.join(lines)
+    def close(self):
+        print(self.table(), file=self.stream)
+
+class ProgressSink:
+    def __init__(self, name, every=1000, stream=sys.stderr):
+        self.name = name
+        self.every = every
+        self.stream = stream
+        self.total = 0
+        self.shown = 0
+    def record(self, kind, name, value):
+        if kind == 'count' and name == self.name:
+            self.total += value
+            if self.total - self.shown >= self.every:
+                self.shown = self.total
+                self.stream.write(f'\r{self.name}: {self.total}')
+                self.stream.flush()
+    def close(self):
+        self.stream.write(f'\r{self.name}: {self.total}\n')
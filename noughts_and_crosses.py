@@ -1,9 +1,13 @@
-from xo import board, ai, token, arbiter
 import base62
+import numpy
 from game import Game
+from noughts_and_crosses_engine import NoughtsAndCrossesEngine
+from metrics import Metrics, ProgressSink, SummarySink
 
 class NoughtsAndCrosses(Game):
+    name = 'xo'
     def __init__(self):
+        self.engine = NoughtsAndCrossesEngine()
         self.game_over_messages = {
             'x':{
                 'squashed': '#draw#',
@@ -16,61 +20,84 @@ class NoughtsAndCrosses(Game):
                 'loser': '#player_win#'
             }
         }
+        rotation = (6, 3, 0, 7, 4, 1, 8, 5, 2)
+        reflection = (2, 1, 0, 5, 4, 3, 8, 7, 6)
+        self.prepared = {}
+        self.symmetries = {tuple(range(9))}
+        while True:
+            closure = self.symmetries | {
+                tuple(symmetry[i] for i in generator)
+                for symmetry in self.symmetries
+                for generator in (rotation, reflection)}
+            if closure == self.symmetries:
+                break
+            self.symmetries = closure
     def start_states(self):
         message = "Would you like to play Noughts and Crosses?"
         start = "I'll start."
         return [('x', message+'\n')]*9 + [('x'+'.'*i + 'o', message+' '+start+'\n') for i in range(9)]
+    def canonicalise(self, state):
+        board = state[1:].ljust(9, '.')
+        return min(state[0] + ''.join(board[i] for i in symmetry) for symmetry in self.symmetries)
     def boardify(self, state):
-        return state[0], board.Board.fromstring(state[1:])
+        return (state[0],) + self.engine.bitboards(state[1:])
+    def prepare(self, states):
+        x, o = self.engine.batch_bitboards([state[1:] for state in states])
+        outcomes = self.engine.outcomes(x, o, numpy.array([state[0] == 'x' for state in states]))
+        legal = self.engine.legal_moves(x, o, outcomes)
+        self.prepared = {
+            state: (self.engine.outcome_names[outcome], moves)
+            for (state, outcome, moves) in zip(states, outcomes.tolist(), legal.tolist())}
+    def status(self, state):
+        try:
+            return self.prepared[state]
+        except KeyError:
+            player, x, o = self.boardify(state)
+            outcome = self.engine.outcome(x, o, player)
+            return outcome, sum(1 << i for i in self.engine.empty_cells(x, o)) if outcome[0] == 'in-progress' else 0
     def options(self, state):
-        player, b = self.boardify(state)
-        outcome = arbiter.outcome(b, player)
-        if outcome['status'] != 'in-progress':
-            return []
-        return [(r, c) for (r, c, p) in b if token.isempty(p)]
+        outcome, moves = self.status(state)
+        return [cell for (i, cell) in enumerate(self.engine.cells) if moves >> i & 1]
     def result(self, state, input):
-        player, b = self.boardify(state)
-        b[input[0], input[1]] = player
-        next_player = token.other_token(player)
-        try:
-            minmax = ai.evaluate(b, next_player)
-        except ValueError:
-            result = [next_player + str(b)]
+        player, x, o = self.boardify(state)
+        x, o = self.engine.place(x, o, player, self.engine.cell_ids[input])
+        next_player = 'o' if player == 'x' else 'x'
+        optimal_moves = self.engine.optimal_moves(x, o, next_player)
+        if optimal_moves is None:
+            result = [next_player + self.engine.board_string(x, o)]
             return {'optimal': result, 'suboptimal': result}
         results = {'optimal': [], 'suboptimal': []}
-        optimal_moves = set(tuple(minmax.positions))
-        for (r,c,p) in b:
-            if token.isempty(p):
-                b[r,c] = next_player
-                if (r,c) in optimal_moves:
-                    results['optimal'].append(player + str(b))
-                else:
-                    results['suboptimal'].append(player + str(b))
-                b[r,c] = '.'
+        for cell in self.engine.empty_cells(x, o):
+            result_state = player + self.engine.board_string(*self.engine.place(x, o, next_player, cell))
+            results['optimal' if optimal_moves >> cell & 1 else 'suboptimal'].append(result_state)
         if not results['suboptimal']:
             results['suboptimal'] = results['optimal']
         return results
         
     def display(self, state):
-        display = []
-        player, b = self.boardify(state)
-        outcome = arbiter.outcome(b, player)
+        player, x, o = self.boardify(state)
+        (status, reason), moves = self.status(state)
         svg = '#init#'+''.join(
             "#{1}{0}#".format(i, p)
-            for (i, (r,c,p)) in
-            enumerate(self.boardify(state)[1],1)
-            if not token.isempty(p))
-        if outcome['status'] != 'in-progress':
-            status = self.game_over_messages[player][outcome['reason']]
+            for (i, p) in
+            enumerate(self.engine.board_string(x, o),1)
+            if p != '.')
+        if status != 'in-progress':
+            status = self.game_over_messages[player][reason]
             return svg + status + "#display_end#"
         else:
             return svg + "#display#"
     def encode(self, state):
-        player, b = self.boardify(state)
-        board_str = player + str(b)
+        player, x, o = self.boardify(state)
+        board_str = player + self.engine.board_string(x, o)
         board_ternary = board_str.translate(str.maketrans({'.':'0', 'x':'1', 'o':'2'}))
         board_num = int(board_ternary, 3)
         return base62.encode(board_num)
+    def decode(self, code):
+        board_ternary = numpy.base_repr(base62.decode(code), 3).rjust(10, '0')
+        if len(board_ternary) != 10 or board_ternary[0] == '0':
+            raise ValueError(f'{code} is not a Noughts and Crosses code')
+        return board_ternary.translate(str.maketrans({'0':'.', '1':'x', '2':'o'}))
     def display_input(self, input):
         r, c = input
         return str(r*3 + c - 3)
@@ -119,4 +146,5 @@ class NoughtsAndCrosses(Game):
         return grammar
 
 if __name__ == '__main__':
-    NoughtsAndCrosses().tracerise('xo')
+    with Metrics(ProgressSink('tracerise.states'), SummarySink()) as metrics:
+        NoughtsAndCrosses().tracerise('xo', metrics=metrics)
@@ -0,0 +1,109 @@
+import numpy
+
+class NoughtsAndCrossesEngine:
+    def __init__(self):
+        self.cells = tuple((r, c) for r in range(1, 4) for c in range(1, 4))
+        self.cell_ids = {cell: i for (i, cell) in enumerate(self.cells)}
+        self.full = (1 << len(self.cells)) - 1
+        rows = [[(r, c) for c in range(1, 4)] for r in range(1, 4)]
+        columns = [[(r, c) for r in range(1, 4)] for c in range(1, 4)]
+        diagonals = [[(1, 1), (2, 2), (3, 3)], [(1, 3), (2, 2), (3, 1)]]
+        self.lines = tuple(sum(1 << self.cell_ids[cell] for cell in line) for line in rows + columns + diagonals)
+        self.line_array = numpy.array(self.lines, dtype=numpy.int64)
+        self.cell_bits = numpy.left_shift(1, numpy.arange(len(self.cells), dtype=numpy.int64))
+        self.popcounts = numpy.array([mask.bit_count() for mask in range(self.full + 1)])
+        self.outcome_names = (
+            ('in-progress', None), ('invalid', 'too-many-moves-ahead'), ('invalid', 'two-winners'),
+            ('gameover', 'winner'), ('gameover', 'loser'), ('gameover', 'squashed'))
+        self.wins = {
+            mask: any(mask & line == line for line in self.lines)
+            for mask in range(self.full + 1)
+        }
+        self.table = {}
+        for token in 'xo':
+            self.negamax(0, 0, token)
+    def bitboards(self, board):
+        x = sum(1 << i for (i, p) in enumerate(board) if p == 'x')
+        o = sum(1 << i for (i, p) in enumerate(board) if p == 'o')
+        return x, o
+    def batch_bitboards(self, boards):
+        cells = numpy.frombuffer(
+            ''.join(board.ljust(len(self.cells), '.') for board in boards).encode(), dtype=numpy.uint8
+        ).reshape(-1, len(self.cells))
+        return (cells == ord('x')) @ self.cell_bits, (cells == ord('o')) @ self.cell_bits
+    def board_string(self, x, o):
+        return ''.join('x' if x >> i & 1 else 'o' if o >> i & 1 else '.' for i in range(len(self.cells)))
+    def place(self, x, o, token, cell):
+        return (x | 1 << cell, o) if token == 'x' else (x, o | 1 << cell)
+    def empty_cells(self, x, o):
+        return [i for i in range(len(self.cells)) if not (x | o) >> i & 1]
+    def outcome(self, x, o, token):
+        if abs(x.bit_count() - o.bit_count()) >= 2:
+            return 'invalid', 'too-many-moves-ahead'
+        if self.wins[x] and self.wins[o]:
+            return 'invalid', 'two-winners'
+        mine, theirs = (x, o) if token == 'x' else (o, x)
+        if self.wins[mine]:
+            return 'gameover', 'winner'
+        if self.wins[theirs]:
+            return 'gameover', 'loser'
+        if x | o == self.full:
+            return 'gameover', 'squashed'
+        return 'in-progress', None
+    def outcomes(self, x, o, x_to_move):
+        x_wins, o_wins = (((boards[:, None] & self.line_array) == self.line_array).any(axis=1) for boards in (x, o))
+        return numpy.select(
+            [
+                abs(self.popcounts[x] - self.popcounts[o]) >= 2,
+                x_wins & o_wins,
+                numpy.where(x_to_move, x_wins, o_wins),
+                numpy.where(x_to_move, o_wins, x_wins),
+                (x | o) == self.full,
+            ],
+            range(1, len(self.outcome_names)), 0)
+    def legal_moves(self, x, o, outcomes):
+        return numpy.where(outcomes == 0, self.full & ~(x | o), 0)
+    def negamax(self, x, o, token):
+        try:
+            return self.table[x, o, token][0]
+        except KeyError:
+            pass
+        other = 'o' if token == 'x' else 'x'
+        depth = (x | o).bit_count()
+        optimal = 0
+        if self.wins[o if token == 'x' else x]:
+            score = -(2 * (len(self.cells) - depth) + len(self.cells) + 1)
+        elif x | o == self.full:
+            score = -depth
+        else:
+            score = None
+            for cell in self.empty_cells(x, o):
+                cell_score = -self.negamax(*self.place(x, o, token, cell), other)
+                if score is None or cell_score > score:
+                    score, optimal = cell_score, 1 << cell
+                elif cell_score == score:
+                    optimal |= 1 << cell
+        self.table[x, o, token] = (score, optimal)
+        return score
+    def optimal_moves(self, x, o, token):
+        mine, theirs = (x, o) if token == 'x' else (o, x)
+        if self.outcome(x, o, token)[0] != 'in-progress' or mine.bit_count() > theirs.bit_count():
+            return None
+        return self.table[x, o, token][1]
+    def validate(self):
+        from xo import ai, board
+        checked = 0
+        for (x, o, token) in self.table:
+            optimal = self.optimal_moves(x, o, token)
+            b = board.Board.fromstring(self.board_string(x, o))
+            try:
+                positions = ai.evaluate(b, token).positions
+            except ValueError:
+                assert optimal is None, (self.board_string(x, o), token)
+                continue
+            assert optimal == sum(1 << self.cell_ids[cell] for cell in positions), (self.board_string(x, o), token)
+            checked += 1
+        return checked
+
+if __name__ == '__main__':
+    print(f'{NoughtsAndCrossesEngine().validate()} positions agree with xo')
@@ -0,0 +1,213 @@
+import bisect
+import heapq
+import json
+import os
+import pickle
+import sqlite3
+import tempfile
+from collections import deque
+from time import perf_counter
+
+class MemoryFrontier:
+    def __init__(self):
+        self.visited = set()
+        self.queue = deque()
+    def push(self, code, state):
+        if code in self.visited:
+            return False
+        self.visited.add(code)
+        self.queue.append(state)
+        return True
+    def pop_batch(self, count):
+        return [self.queue.popleft() for _ in range(min(count, len(self.queue)))]
+    def __len__(self):
+        return len(self.queue)
+    def close(self):
+        pass
+
+class DiskFrontier:
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript('''
+            PRAGMA journal_mode = OFF;
+            PRAGMA synchronous = OFF;
+            DROP TABLE IF EXISTS visited;
+            DROP TABLE IF EXISTS queue;
+            CREATE TABLE visited (code TEXT PRIMARY KEY);
+            CREATE TABLE queue (position INTEGER PRIMARY KEY, state BLOB);
+        ''')
+        self.head = self.tail = 0
+    def push(self, code, state):
+        if not self.connection.execute('INSERT OR IGNORE INTO visited VALUES (?)', (code,)).rowcount:
+            return False
+        self.connection.execute('INSERT INTO queue VALUES (?, ?)', (self.tail, pickle.dumps(state)))
+        self.tail += 1
+        return True
+    def pop_batch(self, count):
+        end = min(self.head + count, self.tail)
+        states = self.connection.execute(
+            'SELECT state FROM queue WHERE position >= ? AND position < ? ORDER BY position', (self.head, end)).fetchall()
+        self.connection.execute('DELETE FROM queue WHERE position >= ? AND position < ?', (self.head, end))
+        self.head = end
+        return [pickle.loads(state) for (state,) in states]
+    def __len__(self):
+        return self.tail - self.head
+    def close(self):
+        self.connection.close()
+
+class BuildCache:
+    def __init__(self, path, settings, checkpoint_interval=60):
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS settings (settings TEXT);
+            CREATE TABLE IF NOT EXISTS states (position INTEGER PRIMARY KEY, code TEXT UNIQUE, state BLOB, results TEXT);
+        ''')
+        settings = json.dumps(settings, sort_keys=True)
+        if self.connection.execute('SELECT settings FROM settings').fetchone() != (settings,):
+            self.connection.executescript('DELETE FROM settings; DELETE FROM states;')
+            self.connection.execute('INSERT INTO settings VALUES (?)', (settings,))
+            self.connection.commit()
+        (self.tail,) = self.connection.execute('SELECT COUNT(*) FROM states').fetchone()
+        (self.head,) = self.connection.execute('SELECT MIN(position) FROM states WHERE results IS NULL').fetchone()
+        if self.head is None:
+            self.head = self.tail
+        self.checkpoint_interval = checkpoint_interval
+        self.last_checkpoint = perf_counter()
+    def push(self, code, state):
+        if not self.connection.execute(
+                'INSERT OR IGNORE INTO states VALUES (?, ?, ?, NULL)', (self.tail, code, pickle.dumps(state))).rowcount:
+            return False
+        self.tail += 1
+        return True
+    def pop_batch(self, count):
+        end = min(self.head + count, self.tail)
+        states = self.connection.execute(
+            'SELECT state FROM states WHERE position >= ? AND position < ? ORDER BY position', (self.head, end)).fetchall()
+        self.head = end
+        return [pickle.loads(state) for (state,) in states]
+    def __len__(self):
+        return self.tail - self.head
+    def record(self, code, results):
+        self.connection.execute('UPDATE states SET results = ? WHERE code = ?', (json.dumps(results), code))
+        if perf_counter() - self.last_checkpoint >= self.checkpoint_interval:
+            self.checkpoint()
+    def checkpoint(self):
+        self.connection.commit()
+        self.last_checkpoint = perf_counter()
+    def states(self):
+        for (state,) in self.connection.execute('SELECT state FROM states ORDER BY position'):
+            yield pickle.loads(state)
+    def items(self):
+        for (code, state, results) in self.connection.execute(
+                'SELECT code, state, results FROM states WHERE results IS NOT NULL ORDER BY position'):
+            yield code, pickle.loads(state), json.loads(results)
+    def close(self):
+        self.checkpoint()
+        self.connection.close()
+
+def json_entry(key, value):
+    return '\t{}: {}'.format(json.dumps(key), json.dumps(value, indent='\t').replace('\n', '\n\t'))
+
+def write_json_object(filename, entries):
+    with open(filename, 'w') as f:
+        separator = '{\n'
+        for (key, value) in entries:
+            f.write(separator + json_entry(key, value))
+            separator = ',\n'
+        f.write('{}' if separator == '{\n' else '\n}')
+
+class SortedJSONWriter:
+    def __init__(self, filename, run_size=100000):
+        self.filename = filename
+        self.run_size = run_size
+        self.directory = tempfile.TemporaryDirectory()
+        self.runs = []
+        self.entries = {}
+    def add(self, key, value):
+        self.entries[key] = value
+        if len(self.entries) >= self.run_size:
+            self.flush()
+    def flush(self):
+        path = os.path.join(self.directory.name, str(len(self.runs)))
+        with open(path, 'w') as f:
+            for key in sorted(self.entries):
+                f.write(json.dumps([key, self.entries[key]]) + '\n')
+        self.runs.append(path)
+        self.entries = {}
+    def close(self):
+        self.flush()
+        runs = [open(path) for path in self.runs]
+        try:
+            write_json_object(self.filename, heapq.merge(*(map(json.loads, run) for run in runs), key=lambda entry: entry[0]))
+        finally:
+            for run in runs:
+                run.close()
+    def __enter__(self):
+        return self
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        self.directory.cleanup()
+
+class BucketedJSONWriter:
+    def __init__(self, filename, last_entry):
+        self.filename = filename
+        self.last_entry = last_entry
+        self.directory = tempfile.TemporaryDirectory()
+        self.buckets = {}
+    def add(self, bucket, key, value):
+        if bucket not in self.buckets:
+            self.buckets[bucket] = open(os.path.join(self.directory.name, str(bucket)), 'w+')
+        self.buckets[bucket].write(json.dumps([key, value]) + '\n')
+    def entries(self):
+        for bucket in sorted(self.buckets, reverse=True):
+            self.buckets[bucket].seek(0)
+            yield from map(json.loads, self.buckets[bucket])
+        yield self.last_entry
+    def close(self):
+        write_json_object(self.filename, self.entries())
+    def __enter__(self):
+        return self
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.close()
+        finally:
+            for bucket in self.buckets.values():
+                bucket.close()
+            self.directory.cleanup()
+
+class GroupedJSONWriter:
+    def __init__(self, filename, last_entry, pattern):
+        self.filename = filename
+        self.last_entry = last_entry
+        self.pattern = pattern
+        self.buckets = {}
+    def add(self, bucket, key, value):
+        self.buckets.setdefault(bucket, []).append((key, value))
+    def groups(self):
+        groups = []
+        code = positions = cursor = None
+        for bucket in sorted(self.buckets, reverse=True):
+            for ((entry_code, input), value) in self.buckets[bucket]:
+                if entry_code != code:
+                    code, positions, cursor = entry_code, {}, len(groups)
+                candidates = positions.setdefault(value, [])
+                index = bisect.bisect_left(candidates, cursor)
+                if index == len(candidates):
+                    candidates.append(len(groups))
+                    groups.append((value, {}))
+                cursor = candidates[index]
+                groups[cursor][1].setdefault(code, []).append(input)
+        return groups
+    def entries(self):
+        for (value, members) in self.groups():
+            yield self.pattern(members), value
+        yield self.last_entry
+    def close(self):
+        write_json_object(self.filename, self.entries())
+    def __enter__(self):
+        return self
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
@@ -0,0 +1,227 @@
+import random
+import sys
+from collections import OrderedDict
+from itertools import combinations, permutations, product
+from math import factorial, prod
+from time import perf_counter
+from sim_engine import shrink, widen, INFINITY, EXACT, LOWER, UPPER
+from metrics import Metrics, SummarySink, null_metrics
+
+WIN = 1000
+
+class RamseyEngine:
+    def __init__(self, vertices=6, red_clique=3, blue_clique=None, table_size=1 << 20, relabelling_limit=720, seed=0,
+            metrics=null_metrics):
+        self.vertices = tuple(range(vertices))
+        self.edges = tuple(combinations(self.vertices, 2))
+        self.edge_ids = {edge: eid for (eid, edge) in enumerate(self.edges)}
+        self.edge_matrix = tuple(
+            tuple(self.edge_ids.get((min(u, v), max(u, v))) for v in self.vertices)
+            for u in self.vertices)
+        self.relabelling_limit = relabelling_limit
+        self.canonical_cache = OrderedDict()
+        self.canonical_cache_size = table_size
+        self.full = (1 << len(self.edges)) - 1
+        self.clique_sizes = (red_clique, blue_clique or red_clique)
+        self.cliques = tuple(self.clique_masks(size) for size in self.clique_sizes)
+        rng = random.Random(seed)
+        self.zobrist = tuple(tuple(rng.getrandbits(64) for edge in self.edges) for colour in range(2))
+        self.zobrist_side = rng.getrandbits(64)
+        self.table_mask = table_size - 1
+        self.table = [None] * table_size
+        self.metrics = metrics
+    def clique_masks(self, size):
+        masks = {eid: [] for eid in range(len(self.edges))}
+        for clique in combinations(self.vertices, size):
+            clique_edges = [self.edge_ids[edge] for edge in combinations(clique, 2)]
+            mask = sum(1 << eid for eid in clique_edges)
+            for eid in clique_edges:
+                masks[eid].append(mask & ~(1 << eid))
+        return {eid: tuple(edge_masks) for (eid, edge_masks) in masks.items()}
+    def to_move(self, masks):
+        return int(masks[0].bit_count() > masks[1].bit_count())
+    def hash(self, masks, colour):
+        key = self.zobrist_side if colour else 0
+        for (c, mask) in enumerate(masks):
+            while mask:
+                low = mask & -mask
+                key ^= self.zobrist[c][low.bit_length() - 1]
+                mask ^= low
+        return key
+    def completes(self, mine, colour, eid):
+        return any(mine & mask == mask for mask in self.cliques[colour][eid])
+    def is_terminal(self, masks):
+        colour = 1 - self.to_move(masks)
+        mine = masks[colour]
+        edges = mine
+        while edges:
+            low = edges & -edges
+            if self.completes(mine, colour, low.bit_length() - 1):
+                return True
+            edges ^= low
+        return False
+    def neighbours(self, masks):
+        neighbours = [[0] * len(self.vertices) for mask in masks]
+        for (c, mask) in enumerate(masks):
+            while mask:
+                low = mask & -mask
+                (u, v) = self.edges[low.bit_length() - 1]
+                neighbours[c][u] |= 1 << v
+                neighbours[c][v] |= 1 << u
+                mask ^= low
+        return neighbours
+    def twin_classes(self, masks):
+        neighbours = self.neighbours(masks)
+        classes = {}
+        for v in self.vertices:
+            for (rep, members) in classes.items():
+                others = ~(1 << v | 1 << rep)
+                if all((n[v] ^ n[rep]) & others == 0 for n in neighbours):
+                    members.append(v)
+                    break
+            else:
+                classes[v] = [v]
+        return {v: members for members in classes.values() for v in members}
+    def refined_cells(self, masks):
+        (red, blue) = self.neighbours(masks)
+        colours = [(red[v].bit_count(), blue[v].bit_count()) for v in self.vertices]
+        while True:
+            cells = {}
+            for v in self.vertices:
+                cells[colours[v]] = cells.get(colours[v], 0) | 1 << v
+            cell_masks = [cells[colour] for colour in sorted(cells)]
+            signatures = [
+                (colours[v],) + tuple((red[v] & cell).bit_count() * 64 + (blue[v] & cell).bit_count() for cell in cell_masks)
+                for v in self.vertices]
+            ranks = {signature: rank for (rank, signature) in enumerate(sorted(set(signatures)))}
+            if len(ranks) == len(cells):
+                break
+            colours = [ranks[signature] for signature in signatures]
+        return [[v for v in self.vertices if cell >> v & 1] for cell in cell_masks]
+    def relabel(self, masks, labels):
+        relabelled = []
+        for mask in masks:
+            result = 0
+            while mask:
+                low = mask & -mask
+                (u, v) = self.edges[low.bit_length() - 1]
+                result |= 1 << self.edge_matrix[labels[u]][labels[v]]
+                mask ^= low
+            relabelled.append(result)
+        return tuple(relabelled)
+    def canonical(self, masks):
+        try:
+            self.canonical_cache.move_to_end(masks)
+            return self.canonical_cache[masks]
+        except KeyError:
+            pass
+        cells = self.refined_cells(masks)
+        if prod(factorial(len(cell)) for cell in cells) > self.relabelling_limit:
+            orderings = [tuple(cells)]
+        else:
+            orderings = product(*(permutations(cell) for cell in cells))
+        best = None
+        for ordering in orderings:
+            labels = [0] * len(self.vertices)
+            for (label, v) in enumerate(v for cell in ordering for v in cell):
+                labels[v] = label
+            relabelled = self.relabel(masks, labels)
+            if best is None or relabelled < best[0]:
+                best = (relabelled, labels)
+        self.canonical_cache[masks] = best
+        if len(self.canonical_cache) > self.canonical_cache_size:
+            self.canonical_cache.popitem(last=False)
+        return best
+    def representative_moves(self, masks, empty):
+        classes = self.twin_classes(masks)
+        moves = []
+        while empty:
+            low = empty & -empty
+            eid = low.bit_length() - 1
+            (u, v) = self.edges[eid]
+            if classes[u] is classes[v]:
+                representative = tuple(classes[u][:2])
+            else:
+                representative = tuple(sorted((classes[u][0], classes[v][0])))
+            if representative == (u, v):
+                moves.append(eid)
+            empty ^= low
+        return moves
+    def ordered_moves(self, masks, colour, empty, first=None):
+        mine, theirs = masks[colour], masks[1 - colour]
+        def order(eid):
+            return (
+                eid != first,
+                self.completes(mine, colour, eid),
+                sum((mine & mask).bit_count() for mask in self.cliques[colour][eid]),
+                -sum((theirs & mask).bit_count() for mask in self.cliques[1 - colour][eid]))
+        return sorted(self.representative_moves(masks, empty), key=order)
+    def search(self, masks, colour, depth, alpha, beta):
+        key = self.hash(masks, colour)
+        slot = key & self.table_mask
+        entry = self.table[slot]
+        first = None
+        if entry is not None and entry[0] == key and entry[1] == masks:
+            (entry_key, entry_masks, entry_depth, value, bound, first) = entry
+            if entry_depth >= depth and (bound == EXACT or (bound == LOWER and value >= beta) or (bound == UPPER and value <= alpha)):
+                self.metrics.count('ramsey.hits')
+                self.horizon |= entry_depth < INFINITY
+                return value
+        empty = self.full & ~(masks[0] | masks[1])
+        if not empty:
+            return 0
+        if not depth:
+            self.horizon = True
+            return 0
+        self.metrics.count('ramsey.nodes')
+        horizon, self.horizon = self.horizon, False
+        low, high = widen(alpha), widen(beta)
+        best = best_move = None
+        for eid in self.ordered_moves(masks, colour, empty, first):
+            if self.completes(masks[colour], colour, eid):
+                if best is None:
+                    best, best_move = -WIN, eid
+                break
+            child = (masks[0] | 1 << eid, masks[1]) if colour == 0 else (masks[0], masks[1] | 1 << eid)
+            score = -self.search(self.canonical(child)[0], 1 - colour, depth - 1, -high, -low)
+            if best is None or score > best:
+                best, best_move = score, eid
+                low = max(low, score)
+                if low >= high:
+                    break
+        bound = UPPER if best <= widen(alpha) else LOWER if best >= widen(beta) else EXACT
+        self.table[slot] = (key, masks, INFINITY if not self.horizon else depth, shrink(best), bound, best_move)
+        self.horizon |= horizon
+        return shrink(best)
+    def solve(self, masks=(0, 0)):
+        colour = self.to_move(masks)
+        if self.is_terminal(masks):
+            return WIN, None
+        canonical, labels = self.canonical(masks)
+        remaining = (self.full & ~(masks[0] | masks[1])).bit_count()
+        score = 0
+        for depth in range(1, remaining + 1):
+            self.horizon = False
+            with self.metrics.timer('ramsey.iteration'):
+                score = self.search(canonical, colour, depth, -INFINITY, INFINITY)
+            if not self.horizon or (score and WIN - abs(score) <= depth):
+                break
+        key = self.hash(canonical, colour)
+        entry = self.table[key & self.table_mask]
+        if entry is None or entry[0] != key or entry[5] is None:
+            return score, None
+        (u, v) = self.edges[entry[5]]
+        return score, self.edge_ids[tuple(sorted((labels.index(u), labels.index(v))))]
+    def evaluate(self, masks=(0, 0)):
+        score, move = self.solve(masks)
+        return score if self.to_move(masks) else -score
+    def best_move(self, masks=(0, 0)):
+        return self.solve(masks)[1]
+
+if __name__ == '__main__':
+    vertices = int(sys.argv[1]) if len(sys.argv) > 1 else 6
+    with Metrics(SummarySink()) as metrics:
+        engine = RamseyEngine(vertices, *map(int, sys.argv[2:]), metrics=metrics)
+        start = perf_counter()
+        score = engine.evaluate()
+        print(f'K{vertices}: value {score} ({"blue" if score > 0 else "red" if score < 0 else "nobody"} wins), {perf_counter() - start:.2f}s')
@@ -0,0 +1,98 @@
+import asyncio
+import json
+import random
+import re
+import sys
+from expander import Expander
+
+class ReplyService:
+    def __init__(self, game, seed=None, batch_size=64, batch_delay=0):
+        self.game = game
+        self.grammar = game.grammar()
+        self.grammar['origin'] = ["{}#*{}#".format(message, game.encode(state)) for (state, message) in game.start_states()]
+        self.grammar['error'] = "Couldn't understand input. Reply in the format \"\\[code\\] \\[input\\]\"."
+        self.expander = Expander(self.grammar, self.state_rules, random.Random(seed))
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.queue = None
+    def state_rules(self, symbol):
+        if not symbol.startswith('*'):
+            return None
+        state = self.game.decode(symbol[1:])
+        inputs = [self.game.display_input(option) for option in self.game.options(state)]
+        return self.game.grammar_entry(symbol[1:], inputs, self.game.display(state))
+    def parse(self, message):
+        for match in re.finditer(r'\w+', message):
+            code = match.group()
+            try:
+                state = self.game.decode(code)
+                if self.game.encode(state) != code:
+                    continue
+                options = self.game.options(state)
+            except (KeyError, ValueError, IndexError):
+                continue
+            rest = message[match.end():]
+            for option in options:
+                if re.search('\\b{}\\b'.format(re.escape(self.game.display_input(option))), rest):
+                    return state, option
+        return None
+    def reply(self, message):
+        if not message.strip():
+            return self.expander.expand('#origin#')
+        parsed = self.parse(message)
+        if parsed is None:
+            return self.expander.expand('#error#')
+        result_codes = {
+            result_type: [self.game.encode(result) for result in result_list]
+            for (result_type, result_list) in self.game.result(*parsed).items()}
+        return self.expander.expand(self.game.reply_value(result_codes))
+    def reply_batch(self, messages):
+        return [self.reply(message) for message in messages]
+    async def handle(self, message):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((message, future))
+        return await future
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            if self.batch_delay:
+                await asyncio.sleep(self.batch_delay)
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            try:
+                replies = await loop.run_in_executor(None, self.reply_batch, [message for (message, future) in batch])
+            except Exception as error:
+                for (message, future) in batch:
+                    future.set_exception(error)
+            else:
+                for ((message, future), reply) in zip(batch, replies):
+                    future.set_result(reply)
+    async def connection(self, reader, writer):
+        try:
+            while line := await reader.readline():
+                reply = await self.handle(json.loads(line))
+                writer.write((json.dumps(reply) + '\n').encode())
+                await writer.drain()
+        finally:
+            writer.close()
+    async def serve(self, host='127.0.0.1', port=0):
+        self.queue = asyncio.Queue()
+        worker = asyncio.create_task(self.run())
+        server = await asyncio.start_server(self.connection, host, port)
+        server.worker = worker
+        return server
+
+async def main(game, host, port):
+    server = await ReplyService(game).serve(host, port)
+    print('Serving on {}:{}'.format(*server.sockets[0].getsockname()[:2]))
+    async with server:
+        await server.serve_forever()
+
+if __name__ == '__main__':
+    name = sys.argv[1] if len(sys.argv) > 1 else 'sim'
+    if name == 'sim':
+        from sim import Sim as game_class
+    else:
+        from noughts_and_crosses import NoughtsAndCrosses as game_class
+    asyncio.run(main(game_class(), '127.0.0.1', int(sys.argv[2]) if len(sys.argv) > 2 else 8765))
@@ -1,12 +1,14 @@
 from game import Game
-from sim_engine import SimEngine, SimState, Colour
+from sim_engine import SimEngine, SimState, Colour, default_cache_path
+from metrics import Metrics, ProgressSink, SummarySink, null_metrics
 from math import sin, cos, pi
 import base62
 
 
 class Sim(Game):
-    def __init__(self):
-        self.engine = SimEngine()
+    name = 'sim'
+    def __init__(self, processes=1, cache_path=default_cache_path, metrics=null_metrics):
+        self.engine = SimEngine(processes, cache_path, metrics)
         self.engine.map_state_space()
         self.engine.perform_minimax()
     def start_states(self):
@@ -34,6 +36,14 @@ class Sim(Game):
         state_ternary = state_string.translate(str.maketrans({'r':'0', 'b':'1', 'e':'2'}))
         state_num = int(state_ternary, 3)
         return base62.encode(state_num)
+    def decode(self, code):
+        state_num = base62.decode(code)
+        red = blue = 0
+        for edge in reversed(range(SimState.edge_count)):
+            state_num, colour = divmod(state_num, 3)
+            red |= (colour == 0) << edge
+            blue |= (colour == 1) << edge
+        return SimState(state_num * SimState.player_bit | red << SimState.edge_count | blue)
     def grammar(self):
         grammar = {}
         positions = {v: (1000*cos((v+4)*pi/3), 1000*sin((v+4)*pi/3)) for v in self.engine.vertices}
@@ -77,4 +87,5 @@ class Sim(Game):
         return ' '.join(str(v+1) for v in self.engine.edges[input])
 
 if __name__ == '__main__':
-    Sim().tracerise('sim')
+    with Metrics(ProgressSink('tracerise.states'), SummarySink()) as metrics:
+        Sim(metrics=metrics).tracerise('sim', metrics=metrics)
@@ -1,12 +1,17 @@
-import networkx
-from typing import NamedTuple, Tuple, Optional, Dict
+import hashlib
+import json
+import os
+import warnings
+import numpy
 from enum import Enum
-from math import copysign
-from itertools import combinations, chain, count
-from dataclasses import dataclass, field
-from collections import defaultdict
-from tqdm import tqdm
-from pickle import dump, load
+from itertools import combinations, permutations
+from collections import OrderedDict
+from collections.abc import Mapping
+from multiprocessing import Pool
+from contextlib import nullcontext
+from time import perf_counter
+from sim_solution import read_solution, write_solution, SolutionError, CorruptSolutionError
+from metrics import Metrics, SummarySink, null_metrics
 
 class Colour(Enum):
     empty = 0
@@ -31,50 +36,195 @@ class Player(Enum):
     def __str__(self):
         return '{} player'.format(self.name).capitalize()
 
-class SimState(NamedTuple):
-    player: Player
-    colours: Tuple[
-        Colour, Colour, Colour, Colour, Colour,
-        Colour, Colour, Colour, Colour,
-        Colour, Colour, Colour,
-        Colour, Colour,
-        Colour
-    ]
+class SimState(int):
+    __slots__ = ()
+    edge_count = 15
+    edge_mask = (1 << edge_count) - 1
+    player_bit = 1 << 2*edge_count
     @classmethod
     def initial_state(cls):
-        return cls(Player.red, (Colour.empty,)*15)
+        return cls(0)
+    @property
+    def player(self):
+        return Player(self >= self.player_bit)
+    @property
+    def red(self):
+        return self >> self.edge_count & self.edge_mask
+    @property
+    def blue(self):
+        return self & self.edge_mask
+    @property
+    def empty(self):
+        return ~(self >> self.edge_count | self) & self.edge_mask
+    @property
+    def colours(self):
+        red, blue = self.red, self.blue
+        return tuple(
+            Colour.red if red >> e & 1 else Colour.blue if blue >> e & 1 else Colour.empty
+            for e in range(self.edge_count))
+    def last_mover_mask(self):
+        return self.red if self >= self.player_bit else self.blue
     def options(self):
-        return (i for (i, c) in enumerate(self.colours) if c is Colour.empty)
+        empty = self.empty
+        while empty:
+            low = empty & -empty
+            yield low.bit_length() - 1
+            empty ^= low
     def apply(self, index):
-        return SimState(self.player.change(), self.colours[:index] + (self.player.colour(),) + self.colours[index+1:])
+        if self >= self.player_bit:
+            return SimState(self - self.player_bit | 1 << index)
+        return SimState(self + self.player_bit | 1 << index + self.edge_count)
+    def __repr__(self):
+        return f'SimState({self.encode()})'
     def __str__(self):
         return '{}, {}'.format(''.join(c.name[0] for c in self.colours), self.player)
     def encode(self):
         return ''.join(c.name[0] for c in (self.player,) + self.colours)
 
-class StateInvariants(NamedTuple):
-    player: Player
-    degree_sequence: Tuple[
-        Tuple[int,int],Tuple[int,int],Tuple[int,int],
-        Tuple[int,int],Tuple[int,int],Tuple[int,int]
-    ]
-    
+UNSOLVED = 0
+NONE = -1
+INFINITY = 1 << 20
+EXACT, LOWER, UPPER = range(3)
 
-class ColourDegree(NamedTuple):
-    red: int
-    blue: int
+def shrink(value):
+    return value - 1 if value > 0 else value + 1 if value < 0 else 0
+
+def widen(bound):
+    return bound + 1 if bound >= 0 else bound - 1
+
+class Successors(Mapping):
+    __slots__ = ('store', 'state_id')
+    def __init__(self, store, state_id):
+        self.store = store
+        self.state_id = state_id
+    def __getitem__(self, option):
+        if not 0 <= option < SimState.edge_count:
+            raise KeyError(option)
+        next_id = self.store.successors.item(self.state_id, option)
+        if next_id == NONE:
+            raise KeyError(option)
+        return self.store.state(next_id)
+    def __iter__(self):
+        return (int(option) for option in numpy.flatnonzero(self.store.successors[self.state_id] != NONE))
+    def __len__(self):
+        return int(numpy.count_nonzero(self.store.successors[self.state_id] != NONE))
 
-@dataclass
 class StateDetails:
-    expanded: bool = False
-    in_progress: Optional[bool] = None
-    winner: Optional[Player] = None
-    value: Optional[int] = None
-    optimal_play: Optional[int] = None
-    successors: Dict[int, SimState] = field(default_factory=dict)
+    __slots__ = ('store', 'state_id')
+    def __init__(self, store, state_id):
+        self.store = store
+        self.state_id = state_id
+    @property
+    def in_progress(self):
+        return self.store.in_progress.item(self.state_id)
+    @property
+    def winner(self):
+        winner = self.store.winner.item(self.state_id)
+        return None if winner == NONE else Player(bool(winner))
+    @property
+    def value(self):
+        value = self.store.value.item(self.state_id)
+        return None if value == UNSOLVED else value
+    @property
+    def optimal_play(self):
+        optimal_play = self.store.optimal_play.item(self.state_id)
+        return None if optimal_play == NONE else optimal_play
+    @property
+    def successors(self):
+        return Successors(self.store, self.state_id)
+
+class StateIndex(Mapping):
+    __slots__ = ('states', 'ids')
+    def __init__(self, states, ids):
+        self.states = states
+        self.ids = ids
+    def __getitem__(self, state):
+        position = int(numpy.searchsorted(self.states, state))
+        if position == len(self.states) or self.states.item(position) != state:
+            raise KeyError(state)
+        return self.ids.item(position)
+    def __iter__(self):
+        return (SimState(state) for state in self.states.tolist())
+    def __len__(self):
+        return len(self.states)
+
+class StateStore(Mapping):
+    columns = (
+        ('states', numpy.int64, 0),
+        ('in_progress', numpy.bool_, False),
+        ('winner', numpy.int8, NONE),
+        ('value', numpy.int16, UNSOLVED),
+        ('optimal_play', numpy.int8, NONE),
+        ('successors', numpy.int32, NONE),
+    )
+    def __init__(self, capacity=1024):
+        self.ids = {}
+        self.size = 0
+        self.capacity = 0
+        for (name, dtype, fill) in self.columns:
+            setattr(self, name, numpy.empty((0,) + self.row_shape(name), dtype=dtype))
+        self.reserve(capacity)
+    def row_shape(self, name):
+        return (SimState.edge_count,) if name == 'successors' else ()
+    def reserve(self, capacity):
+        if capacity <= self.capacity:
+            return
+        for (name, dtype, fill) in self.columns:
+            array = numpy.full((capacity,) + self.row_shape(name), fill, dtype=dtype)
+            array[:self.size] = getattr(self, name)[:self.size]
+            setattr(self, name, array)
+        self.capacity = capacity
+    def add(self, state):
+        if self.size == self.capacity:
+            self.reserve(2 * self.capacity)
+        state_id = self.size
+        self.states[state_id] = state
+        self.ids[state] = state_id
+        self.size += 1
+        return state_id
+    def state(self, state_id):
+        return SimState(self.states.item(state_id))
+    def __getitem__(self, state):
+        return StateDetails(self, self.ids[state])
+    def __iter__(self):
+        return iter(self.ids)
+    def __len__(self):
+        return self.size
+    def __getstate__(self):
+        return {name: getattr(self, name)[:self.size].copy() for (name, dtype, fill) in self.columns}
+    def to_arrays(self):
+        arrays = self.__getstate__()
+        order = numpy.argsort(arrays['states'], kind='stable')
+        arrays['index_states'] = arrays['states'][order]
+        arrays['index_ids'] = order.astype(numpy.int32)
+        return arrays
+    @classmethod
+    def from_arrays(cls, arrays):
+        store = cls.__new__(cls)
+        for (name, dtype, fill) in cls.columns + (('index_states', numpy.int64, 0), ('index_ids', numpy.int32, 0)):
+            if name not in arrays or arrays[name].dtype != dtype:
+                raise CorruptSolutionError(f'solution is missing a valid {name} column')
+        for (name, dtype, fill) in cls.columns:
+            setattr(store, name, arrays[name])
+        store.size = store.capacity = len(store.states)
+        store.ids = StateIndex(arrays['index_states'], arrays['index_ids'])
+        return store
+    def __setstate__(self, arrays):
+        for (name, array) in arrays.items():
+            setattr(self, name, array)
+        self.size = self.capacity = len(self.states)
+        self.ids = {SimState(int(state)): state_id for (state_id, state) in enumerate(self.states)}
+
+default_cache_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sim_data.sim')
 
 class SimEngine:
-    def __init__(self):
+    def __init__(self, processes=1, cache_path=default_cache_path, metrics=null_metrics, checkpoint_interval=60,
+            transposition_size=1 << 16):
+        self.processes = processes
+        self.cache_path = cache_path
+        self.checkpoint_path = None if cache_path is None else cache_path + '.partial'
+        self.checkpoint_interval = checkpoint_interval
+        self.metrics = metrics
         self.vertices = tuple(range(6))
         self.edges = tuple(combinations(self.vertices, 2))
         self.edge_ids = {edge: eid for (eid, edge) in enumerate(self.edges)}
@@ -87,118 +237,300 @@ class SimEngine:
             )
             for (edge, eid) in self.edge_ids.items()
         }
-        self.incidents = {
-            vertex: tuple(
-                self.edge_ids[e]
-                for (v, e) in 
-                chain.from_iterable(
-                    ((v, edge) for v in edge)
-                    for edge in self.edges
-                )
-                if v == vertex
-            )
-            for vertex in self.vertices
+        self.triangle_masks = {
+            eid: tuple(1 << e | 1 << f for (e, f) in triangles)
+            for (eid, triangles) in self.triangles.items()
+        }
+        self.triangle_set = {
+            1 << eid | mask
+            for (eid, masks) in self.triangle_masks.items()
+            for mask in masks
         }
+        self.triangle_array = numpy.array(sorted(self.triangle_set), dtype=numpy.int64)
+        self.option_bits = numpy.left_shift(1, numpy.arange(len(self.edges), dtype=numpy.int64))
+        self.edge_permutations = numpy.array([
+            [self.edge_ids[self.sort_edge((p[u], p[v]))] for (u, v) in self.edges]
+            for p in permutations(self.vertices)
+        ], dtype=numpy.int64)
+        self.red_tables = self.permutation_tables(len(self.edges))
+        self.blue_tables = self.permutation_tables(0)
+        self.transposition_size = transposition_size
+        self.transpositions = OrderedDict()
         self.complete = False
-        self.canonical_states = {}
-        self.states_by_invariants = defaultdict(list)
-        self.state_details = {}
+        self.state_details = StateStore()
         self.load_data()
-    def add_canonical_state(self, state):
-        self.canonical_states[state] = state
-        self.states_by_invariants[self.invariants(state)].append(state)
-        self.state_details[state] = StateDetails()
+    def permutation_tables(self, shift):
+        bits = numpy.left_shift(1, self.edge_permutations + shift)
+        tables = []
+        for edges in (range(0, 8), range(8, len(self.edges))):
+            table = numpy.zeros((1 << len(edges), len(bits)), dtype=numpy.int64)
+            for mask in range(1, len(table)):
+                low = (mask & -mask).bit_length() - 1
+                table[mask] = table[mask & (mask - 1)] | bits[:, edges[low]]
+            tables.append(table)
+        return tuple(tables)
+    def relabellings(self, red, blue):
+        (red_low, red_high), (blue_low, blue_high) = self.red_tables, self.blue_tables
+        return red_low[red & 0xff] | red_high[red >> 8] | blue_low[blue & 0xff] | blue_high[blue >> 8]
+    def canonical_key(self, state):
+        return int(self.relabellings(state.red, state.blue).min())
+    def canonical_keys(self, states, chunk_size=128):
+        (red_low, red_high), (blue_low, blue_high) = self.red_tables, self.blue_tables
+        red, blue = states >> SimState.edge_count & SimState.edge_mask, states & SimState.edge_mask
+        keys = numpy.empty(len(states), dtype=numpy.int64)
+        for start in range(0, len(states), chunk_size):
+            chunk_red, chunk_blue = red[start:start+chunk_size], blue[start:start+chunk_size]
+            relabellings = red_low[chunk_red & 0xff]
+            relabellings |= red_high[chunk_red >> 8]
+            relabellings |= blue_low[chunk_blue & 0xff]
+            relabellings |= blue_high[chunk_blue >> 8]
+            keys[start:start+chunk_size] = relabellings.min(axis=1)
+        return keys
+    def canonical_permutation(self, state):
+        relabellings = self.relabellings(state.red, state.blue)
+        permutation = int(relabellings.argmin())
+        return relabellings.item(permutation), permutation
+    def state_from_key(self, key):
+        red, blue = key >> SimState.edge_count, key & SimState.edge_mask
+        if red.bit_count() == blue.bit_count():
+            return SimState(key)
+        return SimState(key | SimState.player_bit)
     def sort_edge(self, edge):
         return tuple(sorted(edge))
-    def invariants(self, state):
-        return StateInvariants(state.player, self.degree_sequence(state.colours))
-    def degree_sequence(self, colours):
-        return tuple(sorted(tuple(sum(
-                    colours[e] is c
-                    for e in self.incidents[v])
-                for c in Colour.iter_nonempty())
-            for v in self.vertices))
-    def is_isomorphic(self, colours, other_colours):
-        g1 = networkx.generators.complete_graph(6)
-        g2 = networkx.generators.complete_graph(6)
-        c1 = {edge: colour for (edge, colour) in zip(self.edges,colours)}
-        c2 = {edge: colour for (edge, colour) in zip(self.edges,other_colours)}
-        networkx.set_edge_attributes(g1, c1, 'colour')
-        networkx.set_edge_attributes(g2, c2, 'colour')
-        em = networkx.algorithms.isomorphism.categorical_edge_match('colour', Colour.empty)
-        return networkx.is_isomorphic(g1, g2, edge_match=em)
     def canonicalise(self, state):
-        try:
-            return self.canonical_states[state]
-        except KeyError:
-            pass
-        invariants = self.invariants(state)
-        for canon_state in self.states_by_invariants[invariants]:
-            if state.player != canon_state.player:
-                continue
-            if self.is_isomorphic(state.colours, canon_state.colours):
-                self.canonical_states[state] = canon_state
-                return canon_state
-        self.add_canonical_state(state)
-        return state
-    def evaluate_state(self, state, details, last_move):
-        for (e, f) in self.triangles[last_move]:
-            if state.colours[e] == state.colours[f] == state.player.change().colour():
-                details.in_progress = False
-                details.winner = state.player
-                details.value = state.player.win_value()
-                return
-        details.in_progress = True
+        return self.state_from_key(self.canonical_key(state))
+    def evaluate_state(self, state, last_move):
+        moved = state.last_mover_mask()
+        return not any(moved & triangle == triangle for triangle in self.triangle_masks[last_move])
+    def add_state(self, state, in_progress):
+        store = self.state_details
+        state_id = store.add(state)
+        store.in_progress[state_id] = in_progress
+        if not in_progress:
+            store.winner[state_id] = state.player.value
+            store.value[state_id] = state.player.win_value()
+        return state_id
+    def evaluate_batch(self, states):
+        blue = states >= SimState.player_bit
+        coloured = (states >> SimState.edge_count | states) & SimState.edge_mask
+        legal = (~coloured[:, None] & self.option_bits) != 0
+        moved = numpy.where(blue, states, states >> SimState.edge_count)[:, None] & SimState.edge_mask | self.option_bits
+        completed = ((moved[:, :, None] & self.triangle_array) == self.triangle_array).any(axis=2)
+        return legal, ~completed
+    def expand_batch(self, states):
+        legal, in_progress = self.evaluate_batch(states)
+        parents, options = numpy.nonzero(legal)
+        blue = states[parents] >= SimState.player_bit
+        played = numpy.where(
+            blue,
+            states[parents] - SimState.player_bit | self.option_bits[options],
+            states[parents] + SimState.player_bit | self.option_bits[options] << SimState.edge_count)
+        keys = self.canonical_keys(played)
+        children = numpy.where(blue, keys, keys | SimState.player_bit)
+        return parents, options, children, in_progress[parents, options]
+    def expand_frontier(self, pool, states):
+        if pool is None:
+            return self.expand_batch(states)
+        chunk_size = -(-len(states) // (4 * self.processes))
+        starts = range(0, len(states), chunk_size)
+        expansions = pool.map(expand_states, [states[i:i+chunk_size] for i in starts])
+        return tuple(map(numpy.concatenate, zip(*(
+            (parents + start, options, children, in_progress)
+            for (start, (parents, options, children, in_progress)) in zip(starts, expansions)))))
+    def parameters_digest(self):
+        parameters = {
+            'vertices': len(self.vertices),
+            'clique': 3,
+            'canonical_form': 'minimum relabelled red/blue masks',
+            'state_layout': [SimState.edge_count, SimState.player_bit],
+        }
+        return hashlib.sha256(json.dumps(parameters, sort_keys=True).encode()).digest()
     def load_data(self):
         if self.complete:
             return True
+        if self.cache_path is None or not os.path.exists(self.cache_path):
+            return False
         try:
-            with open('sim_data.pck', 'rb') as f:
-                self.canonical_states, self.states_by_invariants, self.state_details = load(f)
-        except Exception:
+            with self.metrics.timer('sim.load'):
+                self.state_details = StateStore.from_arrays(read_solution(self.cache_path, self.parameters_digest()))
+        except SolutionError as error:
+            warnings.warn(f'Ignoring Sim solution cache: {error}')
             return False
         self.complete = True
         return True
     def save_data(self):
-        with open('sim_data.pck', 'wb') as f:
-            dump((self.canonical_states, self.states_by_invariants, self.state_details), f)
-    def map_state_space(self):
+        if self.cache_path is not None:
+            with self.metrics.timer('sim.save'):
+                write_solution(self.cache_path, self.parameters_digest(), self.state_details.to_arrays())
+    def checkpoint_digest(self):
+        return hashlib.sha256(self.parameters_digest() + b'checkpoint').digest()
+    def save_checkpoint(self, frontier):
+        if self.checkpoint_path is None:
+            return
+        with self.metrics.timer('sim.checkpoint'):
+            arrays = self.state_details.to_arrays()
+            arrays['frontier'] = numpy.zeros(len(self.state_details), dtype=numpy.bool_)
+            arrays['frontier'][frontier] = True
+            write_solution(self.checkpoint_path, self.checkpoint_digest(), arrays)
+    def load_checkpoint(self):
+        if self.checkpoint_path is None or not os.path.exists(self.checkpoint_path):
+            return None
+        try:
+            arrays = read_solution(self.checkpoint_path, self.checkpoint_digest())
+            store = StateStore.from_arrays(arrays)
+            if 'frontier' not in arrays:
+                raise CorruptSolutionError('checkpoint has no frontier column')
+        except SolutionError as error:
+            warnings.warn(f'Ignoring Sim checkpoint: {error}')
+            return None
+        store.__setstate__(store.__getstate__())
+        self.state_details = store
+        return [int(state_id) for state_id in numpy.flatnonzero(arrays['frontier'])]
+    def remove_checkpoint(self):
+        if self.checkpoint_path is not None and os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+    def map_state_space(self, resume=True):
         if self.complete:
             return
-        state = SimState.initial_state()
-        self.canonicalise(state)
-        self.state_details[state].in_progress = True
-        state_queue = {state}
-        for _ in tqdm(count()):
-            state = state_queue.pop()
-            details = self.state_details[state]
-            details.expanded = True
-            if details.in_progress:
-                for option in state.options():
-                    next_state = state.apply(option)
-                    next_state = self.canonicalise(next_state)
-                    details.successors[option] = next_state
-                    next_details = self.state_details[next_state]
-                    if next_details.in_progress is None:
-                        state_queue.add(next_state)
-                        self.evaluate_state(next_state, next_details, option)
-            if not state_queue:
-                break
-    def perform_minimax(self):
+        frontier = self.load_checkpoint() if resume else None
+        if frontier is None:
+            self.state_details = StateStore()
+            frontier = [self.add_state(self.canonicalise(SimState.initial_state()), True)]
+        store = self.state_details
+        last_checkpoint = perf_counter()
+        pool = Pool(self.processes, initializer=start_worker) if self.processes > 1 else None
+        with pool or nullcontext():
+            while frontier:
+                self.metrics.observe('sim.frontier', len(frontier))
+                frontier = numpy.array(frontier)
+                with self.metrics.timer('sim.expand'):
+                    parents, options, children, in_progress = self.expand_frontier(pool, store.states[frontier])
+                with self.metrics.timer('sim.store'):
+                    new_states, first = numpy.unique(children, return_index=True)
+                    new_in_progress = in_progress[first]
+                    first_id = len(store)
+                    for (next_state, next_in_progress) in zip(new_states.tolist(), new_in_progress.tolist()):
+                        self.add_state(SimState(next_state), next_in_progress)
+                    store.successors[frontier[parents], options] = first_id + numpy.searchsorted(new_states, children)
+                self.metrics.count('sim.expansions', len(children))
+                self.metrics.count('sim.states', len(new_states))
+                self.metrics.count('sim.terminal', int((~new_in_progress).sum()))
+                frontier = (first_id + numpy.flatnonzero(new_in_progress)).tolist()
+                if frontier and perf_counter() - last_checkpoint >= self.checkpoint_interval:
+                    self.save_checkpoint(frontier)
+                    last_checkpoint = perf_counter()
+    def perform_minimax(self, cross_check=False):
         if self.complete:
             return
-        self.minimax(SimState.initial_state())
+        with self.metrics.timer('sim.retrograde'):
+            self.retrograde()
+        if cross_check:
+            self.cross_check()
         self.save_data()
+        self.remove_checkpoint()
         self.complete = True
-    def minimax(self, state):
-        details = self.state_details[state]
-        if details.value is not None:
-            return details.value
-        options = [(self.minimax(next_state), option) for (option, next_state) in details.successors.items()]
-        value, edge = state.player.optimiser()(options)
-        details.optimal_play = edge
-        details.value = value - (1 if value > 0 else -1)
-        return details.value
+    def layers(self):
+        store = self.state_details
+        coloured = SimState.player_bit - 1
+        depths = numpy.array([(state & coloured).bit_count() for state in store.states[:store.size].tolist()])
+        return [numpy.flatnonzero(depths == depth) for depth in range(SimState.edge_count + 1)]
+    def retrograde(self):
+        store = self.state_details
+        options = numpy.arange(SimState.edge_count)
+        for layer in reversed(self.layers()):
+            layer = layer[store.in_progress[layer]]
+            if not len(layer):
+                continue
+            successors = store.successors[layer]
+            blue = (store.states[layer] >= SimState.player_bit)[:, None]
+            scores = store.value[successors].astype(numpy.int64) * len(options) + options
+            scores = numpy.where(blue, scores, -scores)
+            scores[successors == NONE] = numpy.iinfo(numpy.int64).min
+            best = numpy.take_along_axis(scores, scores.argmax(axis=1)[:, None], axis=1)[:, 0]
+            best = numpy.where(blue[:, 0], best, -best)
+            values = best // len(options)
+            store.optimal_play[layer] = best % len(options)
+            store.value[layer] = numpy.where(values > 0, values - 1, values + 1)
+    def cross_check(self):
+        store = self.state_details
+        values = store.value[:store.size].copy()
+        optimal_play = store.optimal_play[:store.size].copy()
+        store.value[:store.size][store.in_progress[:store.size]] = UNSOLVED
+        store.optimal_play[:store.size] = NONE
+        self.minimax(store.ids[SimState.initial_state()])
+        if not (numpy.array_equal(values, store.value[:store.size])
+                and numpy.array_equal(optimal_play, store.optimal_play[:store.size])):
+            raise RuntimeError('retrograde solution differs from minimax')
+    def minimax(self, state_id):
+        store = self.state_details
+        if store.value.item(state_id) != UNSOLVED:
+            return store.value.item(state_id)
+        options = [
+            (self.minimax(next_id), option)
+            for (option, next_id) in enumerate(store.successors[state_id].tolist())
+            if next_id != NONE]
+        value, edge = store.state(state_id).player.optimiser()(options)
+        store.optimal_play[state_id] = edge
+        store.value[state_id] = value - (1 if value > 0 else -1)
+        return store.value.item(state_id)
+    def is_terminal(self, state):
+        moved = state.last_mover_mask()
+        return any(moved & triangle == triangle for triangle in self.triangle_set)
+    def ordered_options(self, state, first=None):
+        mine = state.blue if state >= SimState.player_bit else state.red
+        def order(option):
+            pairs = self.triangle_masks[option]
+            return (option != first, any(mine & pair == pair for pair in pairs), sum((mine & pair).bit_count() for pair in pairs))
+        return sorted(state.options(), key=order)
+    def store_transposition(self, state, entry):
+        self.transpositions[state] = entry
+        self.transpositions.move_to_end(state)
+        if len(self.transpositions) > self.transposition_size:
+            self.transpositions.popitem(last=False)
+            self.metrics.count('sim.query.evictions')
+    def search(self, state, alpha, beta):
+        move = None
+        entry = self.transpositions.get(state)
+        if entry is not None:
+            self.transpositions.move_to_end(state)
+            value, bound, move = entry
+            if bound == EXACT or (bound == LOWER and value >= beta) or (bound == UPPER and value <= alpha):
+                self.metrics.count('sim.query.hits')
+                return value, move
+        self.metrics.count('sim.query.nodes')
+        blue = state >= SimState.player_bit
+        low, high = widen(alpha), widen(beta)
+        best = best_move = None
+        for option in self.ordered_options(state, move):
+            played = state.apply(option)
+            if self.evaluate_state(played, option):
+                value = self.search(self.canonicalise(played), low, high)[0]
+            else:
+                value = played.player.win_value()
+            if best is None or (value > best if blue else value < best):
+                best, best_move = value, option
+                if blue:
+                    low = max(low, value)
+                else:
+                    high = min(high, value)
+                if low >= high:
+                    break
+        bound = UPPER if best <= widen(alpha) else LOWER if best >= widen(beta) else EXACT
+        self.store_transposition(state, (shrink(best), bound, best_move))
+        return shrink(best), best_move
+    def query(self, state):
+        if self.is_terminal(state):
+            return state.player.win_value(), None, None
+        key, permutation = self.canonical_permutation(state)
+        value, move = self.search(self.state_from_key(key), -INFINITY, INFINITY)
+        return value, permutation, move
+    def evaluate(self, state):
+        return self.query(state)[0]
+    def best_move(self, state):
+        value, permutation, move = self.query(state)
+        if move is None:
+            return None
+        return int(numpy.flatnonzero(self.edge_permutations[permutation] == move)[0])
     def sample_game(self):
         state = SimState.initial_state()
         while True:
@@ -209,9 +541,19 @@ class SimEngine:
             print(details.optimal_play)
             state = details.successors[details.optimal_play]
 
+worker_engine = None
+
+def start_worker():
+    global worker_engine
+    worker_engine = SimEngine(cache_path=None)
+
+def expand_states(states):
+    return worker_engine.expand_batch(states)
+
 if __name__ == '__main__':
-    SE = SimEngine()
-    SE.map_state_space()
-    print(f'{len(SE.state_details)} states')
-    SE.perform_minimax()
-    SE.sample_game()
+    with Metrics(SummarySink()) as metrics:
+        SE = SimEngine(metrics=metrics)
+        SE.map_state_space()
+        print(f'{len(SE.state_details)} states')
+        SE.perform_minimax()
+        SE.sample_game()
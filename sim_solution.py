@@ -0,0 +1,81 @@
+import mmap
+import os
+import struct
+import zlib
+import numpy
+
+MAGIC = b'SIMSOLN\x00'
+VERSION = 2
+HEADER = struct.Struct('<8sIIQ32sI')
+COLUMN = struct.Struct('<16s8sQQQ')
+ALIGNMENT = 64
+
+class SolutionError(Exception):
+    pass
+
+class CorruptSolutionError(SolutionError):
+    pass
+
+class StaleSolutionError(SolutionError):
+    pass
+
+def aligned(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+def write_solution(path, digest, columns):
+    rows = len(next(iter(columns.values())))
+    start = offset = aligned(HEADER.size + COLUMN.size * len(columns))
+    descriptors = []
+    for (name, array) in columns.items():
+        if len(array) != rows:
+            raise ValueError(f'column {name} has {len(array)} rows, expected {rows}')
+        array = numpy.ascontiguousarray(array)
+        descriptors.append((name, array, offset))
+        offset = aligned(offset + array.nbytes)
+    payload = bytearray(offset - start)
+    for (name, array, column_offset) in descriptors:
+        payload[column_offset - start:column_offset - start + array.nbytes] = array.tobytes()
+    table = b''.join(
+        COLUMN.pack(name.encode(), array.dtype.str.encode(), array.shape[1] if array.ndim == 2 else 0, column_offset, array.nbytes)
+        for (name, array, column_offset) in descriptors)
+    header = HEADER.pack(MAGIC, VERSION, len(columns), rows, digest, zlib.crc32(payload, zlib.crc32(table))) + table
+    temporary_path = f'{path}.{os.getpid()}.tmp'
+    with open(temporary_path, 'wb') as f:
+        f.write(header.ljust(start, b'\x00'))
+        f.write(payload)
+    os.replace(temporary_path, path)
+
+def read_solution(path, digest, verify=True):
+    with open(path, 'rb') as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError as error:
+            raise CorruptSolutionError(f'{path} is empty') from error
+    if len(data) < HEADER.size:
+        raise CorruptSolutionError(f'{path} is too short for a solution header')
+    magic, version, column_count, rows, file_digest, checksum = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise CorruptSolutionError(f'{path} is not a Sim solution file')
+    if version != VERSION:
+        raise StaleSolutionError(f'{path} has format version {version}, expected {VERSION}')
+    if file_digest != digest:
+        raise StaleSolutionError(f'{path} was solved with different engine parameters')
+    start = aligned(HEADER.size + COLUMN.size * column_count)
+    if len(data) < start:
+        raise CorruptSolutionError(f'{path} is truncated')
+    table = memoryview(data)[HEADER.size:HEADER.size + COLUMN.size * column_count]
+    if verify and zlib.crc32(memoryview(data)[start:], zlib.crc32(table)) != checksum:
+        raise CorruptSolutionError(f'{path} failed its checksum')
+    columns = {}
+    for i in range(column_count):
+        name, dtype, width, offset, nbytes = COLUMN.unpack_from(data, HEADER.size + COLUMN.size * i)
+        shape = (rows, width) if width else (rows,)
+        try:
+            name = name.rstrip(b'\x00').decode()
+            dtype = numpy.dtype(dtype.rstrip(b'\x00').decode())
+        except (UnicodeDecodeError, TypeError, ValueError) as error:
+            raise CorruptSolutionError(f'{path} has an invalid column table') from error
+        if offset < start or offset + nbytes > len(data) or nbytes != dtype.itemsize * int(numpy.prod(shape)):
+            raise CorruptSolutionError(f'{path} has an invalid column table')
+        columns[name] = numpy.frombuffer(data, dtype, int(numpy.prod(shape)), offset).reshape(shape)
+    return columns